@@ -0,0 +1,72 @@
+import os
+import statistics
+
+# Adaptive in-flight limit per Ollama host (AIMD): the limit grows by one after every window of
+# requests whose latency looks healthy and is cut when the server errors, times out or slows down.
+# The configured concurrency (or per-host limit) is the starting point.
+ADAPTIVE_CONCURRENCY = os.environ.get("LLM_TESTER_ADAPTIVE_CONCURRENCY", "0") == "1"
+MIN_CONCURRENCY = int(os.environ.get("LLM_TESTER_MIN_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.environ.get("LLM_TESTER_MAX_CONCURRENCY", "0"))  # 0 means four times the starting limit
+LATENCY_SLO = float(os.environ.get("LLM_TESTER_LATENCY_SLO", "60"))  # mean request latency target in seconds; 0 disables
+LATENCY_TOLERANCE = float(os.environ.get("LLM_TESTER_LATENCY_TOLERANCE", "2.0"))  # allowed slowdown per token over the baseline
+ERROR_BACKOFF = 0.5  # limit multiplier after server errors, connection failures or timeouts
+SLOWDOWN_BACKOFF = 0.8  # limit multiplier when latency is above the target or tolerance
+BASELINE_DRIFT = 1.02  # the baseline creeps up each window so it follows slower workloads
+
+class AdaptiveLimit:
+    # Decisions are taken once per window of `limit` completed requests, i.e. roughly once per round
+    # trip, so one burst of failures only cuts the limit once
+    def __init__(self, name, initial):
+        self.name = name
+        self.minimum = max(1, MIN_CONCURRENCY)
+        self.maximum = max(initial, MAX_CONCURRENCY or initial * 4)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.samples = []  # (latency, latency per generated token) since the last decision
+        self.errors = 0
+        self.baseline = None
+        self.lowest = self.highest = self.limit
+        self.changes = 0
+
+    # latency in seconds; the model load time reported in the response is left out, since a reload
+    # after eviction says nothing about how many requests the server can take
+    def observe(self, latency, response=None, overloaded=False):
+        if overloaded:
+            self.errors += 1
+        elif response is not None:
+            latency = max(0.0, latency - (response.get("load_duration") or 0) / 1e9)
+            self.samples.append((latency, latency / max(1, response.get("eval_count") or 0)))
+        if len(self.samples) + self.errors >= self.limit:
+            self.decide()
+
+    def decide(self):
+        samples, errors = self.samples, self.errors
+        self.samples, self.errors = [], 0
+        if errors:
+            new_limit = int(self.limit * ERROR_BACKOFF)
+            reason = f"{errors} server errors or timeouts"
+        elif not samples:
+            return
+        else:
+            mean_latency = sum(latency for latency, _ in samples) / len(samples)
+            per_token = statistics.median(per_token for _, per_token in samples)
+            self.baseline = per_token if self.baseline is None else min(per_token, self.baseline * BASELINE_DRIFT)
+            if LATENCY_SLO > 0 and mean_latency > LATENCY_SLO:
+                new_limit = int(self.limit * SLOWDOWN_BACKOFF)
+                reason = f"mean latency {mean_latency:.1f}s above the {LATENCY_SLO:g}s target"
+            elif per_token > self.baseline * LATENCY_TOLERANCE:
+                new_limit = int(self.limit * SLOWDOWN_BACKOFF)
+                reason = f"{per_token * 1000:.0f}ms per token, {per_token / self.baseline:.1f}x the baseline"
+            else:
+                new_limit = self.limit + 1
+                reason = f"mean latency {mean_latency:.1f}s, {per_token * 1000:.0f}ms per token"
+        new_limit = min(max(new_limit, self.minimum), self.maximum)
+        if new_limit != self.limit:
+            print(f"Concurrency {self.name}: {self.limit} -> {new_limit} ({reason})")
+            self.changes += 1
+            self.limit = new_limit
+            self.lowest = min(self.lowest, new_limit)
+            self.highest = max(self.highest, new_limit)
+
+    def report(self):
+        return (f"Adaptive concurrency {self.name}: final limit {self.limit} (range {self.lowest}-{self.highest}, "
+                f"{self.changes} changes)")
@@ -0,0 +1,87 @@
+import os
+
+# Prompts per forward pass in the batched pre-scan; 0 disables batching (one prompt per call)
+DEFAULT_SCAN_BATCH_SIZE = int(os.environ.get("LLM_TESTER_SCAN_BATCH", "0"))
+
+# Where each scanner keeps its transformers pipeline, which inputs it feeds it for a prompt,
+# and the extra call arguments it passes. Scanners not listed here are scanned unbatched.
+BATCH_ADAPTERS = {
+    "PromptInjection": ("_pipeline", lambda scanner, prompt: scanner._match_type.get_inputs(prompt), lambda scanner: ((), {})),
+    "Toxicity": ("_pipeline", lambda scanner, prompt: scanner._match_type.get_inputs(prompt), lambda scanner: ((), {})),
+    "BanTopics": ("_classifier", lambda scanner, prompt: [prompt], lambda scanner: ((scanner._topics,), {"multi_label": False})),
+}
+
+def call_key(args, kwargs):
+    return repr(args) + repr(sorted(kwargs.items()))
+
+class BatchedPipeline:
+    # Stands in for a scanner's pipeline: serves results computed ahead of time in batches and
+    # falls through to the real pipeline for anything that was not prefetched
+    def __init__(self, pipeline, batch_size):
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.results = {}
+
+    def __getattr__(self, name):
+        return getattr(self.pipeline, name)
+
+    def run(self, texts, args, kwargs, batch_size):
+        key = call_key(args, kwargs)
+        # Length-sorted batches keep padding inside each forward pass small
+        missing = sorted({text for text in texts if (text, key) not in self.results}, key=len)
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            outputs = self.pipeline(chunk, *args, batch_size=len(chunk), **kwargs)
+            for text, output in zip(chunk, outputs):
+                self.results[(text, key)] = output
+
+    def prefetch(self, texts, args, kwargs):
+        self.run(texts, args, kwargs, self.batch_size)
+
+    def __call__(self, inputs, *args, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        self.run(texts, args, kwargs, max(1, len(texts)))
+        key = call_key(args, kwargs)
+        outputs = [self.results[(text, key)] for text in texts]
+        return outputs[0] if isinstance(inputs, str) else outputs
+
+    def clear(self):
+        self.results = {}
+
+# Output scanners such as output Toxicity delegate to a wrapped input scanner
+def underlying_scanner(scanner):
+    return getattr(scanner, "_scanner", scanner)
+
+# Wrap the pipelines of known scanners in place; returns the (scanner, adapter) pairs that were wrapped
+def enable_batching(scanners, batch_size=DEFAULT_SCAN_BATCH_SIZE):
+    batched = []
+    for scanner in map(underlying_scanner, scanners):
+        adapter = BATCH_ADAPTERS.get(type(scanner).__name__)
+        if adapter is None or not hasattr(scanner, adapter[0]):
+            continue
+        pipeline = getattr(scanner, adapter[0])
+        if not isinstance(pipeline, BatchedPipeline):
+            pipeline = BatchedPipeline(pipeline, batch_size)
+            setattr(scanner, adapter[0], pipeline)
+        pipeline.batch_size = batch_size
+        batched.append((scanner, adapter))
+    return batched
+
+# Run every batchable scanner's classifier over all prompts ahead of scan_prompt, so the
+# per-prompt scan that follows only does llm_guard's own scoring on cached outputs
+def prescan_batch(scanners, prompts, batch_size=DEFAULT_SCAN_BATCH_SIZE):
+    prompts = [prompt for prompt in prompts if prompt.strip() != ""]  # scanners skip empty prompts
+    for scanner, (attribute, get_inputs, get_call_args) in enable_batching(scanners, batch_size):
+        texts = []
+        for prompt in prompts:
+            texts.extend(get_inputs(scanner, prompt))
+        args, kwargs = get_call_args(scanner)
+        getattr(scanner, attribute).prefetch(texts, args, kwargs)
+
+# Drop cached classifier outputs once the prompts they belong to have been scanned
+def clear_prescan(scanners):
+    for scanner in map(underlying_scanner, scanners):
+        adapter = BATCH_ADAPTERS.get(type(scanner).__name__)
+        pipeline = getattr(scanner, adapter[0], None) if adapter else None
+        if isinstance(pipeline, BatchedPipeline):
+            pipeline.clear()
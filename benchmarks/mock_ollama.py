@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REFUSAL_TEXT = "I cannot help with that request. It could cause harm, so I will not provide any details on it."
+ANSWER_WORDS = ("Sure , here is a detailed answer covering the steps , the background and a few practical "
+                "examples that should make the topic easier to follow").split()
+
+# Latency distributions in seconds: "fixed:0.2", "uniform:0.1,0.5", "lognormal:<median>,<sigma>", "exp:<mean>"
+def parse_latency(spec):
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution '{spec}', expected fixed:s, uniform:a,b, lognormal:median,sigma or exp:mean")
+
+# Stable per-prompt coin flip, so a given prompt always gets the same kind of answer
+def prompt_fraction(prompt, seed):
+    return int(hashlib.sha1(f"{seed}:{prompt}".encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+class MockStats:
+    # Arrival and completion times of /api/chat requests. A failed request is chained to the next
+    # request with the same messages, so a prompt's latency includes its retries.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.aborted = 0
+        self.failed_since = {}
+        self.completed = []
+
+    def record(self, key, arrived, finished, ok):
+        with self.lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+                self.failed_since.setdefault(key, arrived)
+                return
+            self.completed.append(finished - self.failed_since.pop(key, arrived))
+
+    def latencies(self):
+        with self.lock:
+            return list(self.completed)
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=11500, latency="lognormal:0.05,0.5", token_rate=500.0, response_tokens=40,
+                 refusal_ratio=0.5, error_rate=0.0, seed=0):
+        super().__init__(("127.0.0.1", port), MockOllamaHandler)
+        self.latency = parse_latency(latency)
+        self.token_rate = token_rate
+        self.response_tokens = response_tokens
+        self.refusal_ratio = refusal_ratio
+        self.error_rate = error_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats = MockStats()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def sample(self):
+        with self.rng_lock:
+            return self.latency(self.rng), self.rng.random() < self.error_rate
+
+    def response_words(self, prompt, num_predict):
+        if prompt_fraction(prompt, self.seed) < self.refusal_ratio:
+            words = REFUSAL_TEXT.split()
+        else:
+            words = (ANSWER_WORDS * (self.response_tokens // len(ANSWER_WORDS) + 1))[:self.response_tokens]
+        if num_predict and num_predict > 0:
+            return words[:num_predict], len(words) > num_predict
+        return words, False
+
+    def start_background(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Health checks of the host pool use /api/ps
+    def do_GET(self):
+        if self.path in ("/api/ps", "/api/tags"):
+            self.send_json(200, {"models": []})
+        elif self.path in ("/", "/api/version"):
+            self.send_json(200, {"version": "0.0.0-mock"})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        arrived = time.perf_counter()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        # Empty generate requests load or unload a model (model_matrix.py); nothing to do here
+        if self.path == "/api/generate" and not body.get("prompt"):
+            self.send_json(200, {"model": body.get("model"), "response": "", "done": True, "done_reason": "load" if body.get("keep_alive") != 0 else "unload"})
+            return
+        if self.path != "/api/chat":
+            self.send_json(404, {"error": f"{self.path} is not mocked"})
+            return
+        server = self.server
+        messages = body.get("messages") or []
+        prompt = messages[-1]["content"] if messages else ""
+        key = hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        delay, fail = server.sample()
+        time.sleep(delay)
+        if fail:
+            self.send_json(500, {"error": "mock server error"})
+            server.stats.record(key, arrived, time.perf_counter(), False)
+            return
+        options = body.get("options") or {}
+        words, truncated = server.response_words(prompt, options.get("num_predict"))
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        final = {
+            "model": body.get("model", "llama3"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "length" if truncated else "stop",
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(delay * 1e9),
+            "eval_count": len(words),
+            "eval_duration": int(len(words) / server.token_rate * 1e9) if server.token_rate > 0 else 0,
+            "load_duration": 0
+        }
+        final["total_duration"] = final["prompt_eval_duration"] + final["eval_duration"]
+        if not body.get("stream", True):
+            if server.token_rate > 0:
+                time.sleep(len(words) / server.token_rate)
+            final["message"] = {"role": "assistant", "content": " ".join(words)}
+            self.send_json(200, final)
+            server.stats.record(key, arrived, time.perf_counter(), True)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                if server.token_rate > 0:
+                    time.sleep(1.0 / server.token_rate)
+                self.write_chunk({"model": final["model"], "created_at": final["created_at"], "done": False,
+                                  "message": {"role": "assistant", "content": (" " if i else "") + word}})
+            final["message"] = {"role": "assistant", "content": ""}
+            self.write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped the stream early (refusal or toxic span)
+            with server.stats.lock:
+                server.stats.aborted += 1
+        server.stats.record(key, arrived, time.perf_counter(), True)
+
+    def write_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+def add_mock_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="Time to first token: fixed:s, uniform:a,b, lognormal:median,sigma or exp:mean (seconds)")
+    parser.add_argument("--token-rate", type=float, default=500.0, help="Generated tokens per second per request (0 for instant)")
+    parser.add_argument("--response-tokens", type=int, default=40, help="Length of non-refusal answers in tokens")
+    parser.add_argument("--refusal-ratio", type=float, default=0.5, help="Fraction of prompts answered with a refusal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 500")
+    parser.add_argument("--seed", type=int, default=0)
+
+def server_from_args(args, port):
+    return MockOllamaServer(port, latency=args.latency, token_rate=args.token_rate, response_tokens=args.response_tokens,
+                            refusal_ratio=args.refusal_ratio, error_rate=args.error_rate, seed=args.seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server speaking /api/chat, for offline benchmarks and tests.")
+    parser.add_argument("--port", type=int, default=11500)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args, args.port)
+    print(f"Mock Ollama listening on {server.url} (set OLLAMA_HOST={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from mock_ollama import add_mock_arguments, server_from_args
+from synthetic_data import write_datasets
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNERS = {
+    "unprotected_llm": "unprotected_test_llm.py",
+    "unprotected_toxicchat": "unprotected_test_toxicchat.py",
+    "guarded": "llmguard_test_llm.py"
+}
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+# Run one runner script on the whole dataset in workdir; returns (exit code, wall time, peak RSS in MB)
+def run_runner(script, workdir, env, log_path):
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        # --range 0 selects everything without asking
+        proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script), "--no-cache", "--range", "0"], cwd=workdir, env=env,
+                                stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, wall, usage.ru_maxrss / 1024
+
+def benchmark(name, rows, args, port):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-{rows}-")
+    write_datasets(workdir, rows, args.conversations, args.turns, args.seed)
+    server = server_from_args(args, port)
+    server.start_background()
+    env = dict(os.environ, OLLAMA_HOST=server.url, LLM_TESTER_CONCURRENCY=str(args.concurrency),
+               LLM_TESTER_STREAM="1" if args.stream else "0")
+    env.pop("LLM_TESTER_HOSTS", None)
+    try:
+        code, wall, peak_rss = run_runner(RUNNERS[name], workdir, env, os.path.join(workdir, "runner.log"))
+    finally:
+        server.shutdown()
+        server.server_close()
+    latencies = server.stats.latencies()
+    result = {
+        "runner": name,
+        "rows": rows,
+        "exit_code": code,
+        "wall_time": round(wall, 3),
+        "prompts": len(latencies),
+        "requests": server.stats.requests,
+        "server_errors": server.stats.errors,
+        "streams_stopped_early": server.stats.aborted,
+        "prompts_per_sec": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "peak_rss_mb": round(peak_rss, 1)
+    }
+    if code != 0 or args.keep:
+        print(f"  runner output kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def print_table(results):
+    print(f"\n{'runner':<22}{'rows':>8}{'prompts':>9}{'wall s':>9}{'prompts/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MB':>9}")
+    for r in results:
+        ms = lambda v: f"{v * 1000:.0f}" if v is not None else "-"
+        print(f"{r['runner']:<22}{r['rows']:>8}{r['prompts']:>9}{r['wall_time']:>9.1f}{r['prompts_per_sec'] or 0:>11.1f}"
+              f"{ms(r['latency_p50']):>9}{ms(r['latency_p95']):>9}{ms(r['latency_p99']):>9}{r['peak_rss_mb']:>9.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure runner throughput, latency and memory against a mock Ollama server.")
+    parser.add_argument("--sizes", default="1000", help="Comma-separated dataset sizes, e.g. 1000,10000,100000")
+    parser.add_argument("--runners", default=None, help=f"Comma-separated runners out of {', '.join(RUNNERS)} (default: all available)")
+    parser.add_argument("--concurrency", type=int, default=16, help="LLM_TESTER_CONCURRENCY for the runners")
+    parser.add_argument("--stream", action="store_true", help="Run with LLM_TESTER_STREAM=1 (mock responses are streamed)")
+    parser.add_argument("--conversations", type=int, default=1, help="Blue and red conversations per HarmfulQA entry")
+    parser.add_argument("--turns", type=int, default=2, help="Human turns per conversation")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are appended to")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directories with datasets, results and runner logs")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.runners:
+        names = [name.strip() for name in args.runners.split(",")]
+    else:
+        names = list(RUNNERS)
+        # The guarded runner needs LLM Guard and its models
+        if importlib.util.find_spec("llm_guard") is None:
+            print("llm_guard is not installed, skipping the guarded runner")
+            names.remove("guarded")
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = []
+    for rows in sizes:
+        for name in names:
+            print(f"Benchmarking {name} on {rows} rows...")
+            results.append(benchmark(name, rows, args, args.port))
+    print_table(results)
+
+    previous = []
+    if os.path.exists(args.output):
+        with open(args.output, "r") as f:
+            previous = json.load(f)
+    previous.append({
+        "timestamp": datetime.datetime.now().isoformat(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "keep")},
+        "results": results
+    })
+    with open(args.output, "w") as f:
+        json.dump(previous, f, indent=2)
+    print(f"\nResults appended to {args.output}")
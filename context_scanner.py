@@ -0,0 +1,134 @@
+import json
+import os
+from guard_scanners import prompt_with_context, scan_input, scan_input_verdicts
+
+# Previous exchanges (human turn + reply) scanned together with a new turn; unset (-1) rescans the full history
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get("LLM_TESTER_CONTEXT_WINDOW", "-1"))
+# How the verdicts of the cached windows are combined: current, max or majority
+DEFAULT_CONTEXT_POLICY = os.environ.get("LLM_TESTER_CONTEXT_POLICY", "max")
+# Also run the full-history scan for every turn and report how often the verdicts agree
+DEFAULT_CONTEXT_COMPARE = os.environ.get("LLM_TESTER_CONTEXT_COMPARE", "0") == "1"
+
+CONTEXT_POLICIES = ("current", "max", "majority")
+
+class ConversationScanState:
+    # Per-conversation cache of the verdicts and scores of the last window_turns + 1 scanned windows
+    def __init__(self, window_turns, policy=DEFAULT_CONTEXT_POLICY):
+        if policy not in CONTEXT_POLICIES:
+            raise ValueError(f"Unknown context policy '{policy}', expected one of {', '.join(CONTEXT_POLICIES)}")
+        self.window_turns = window_turns
+        self.policy = policy
+        self.history = []
+
+    # The new human turn plus the last window_turns exchanges; context alternates human/gpt messages
+    def scan_text(self, context, turn):
+        return prompt_with_context(context[max(0, len(context) - 2 * self.window_turns):], turn)
+
+    # A majority vote needs every scanner's verdict on every window, so those windows are not scanned fail-fast
+    def full_scores(self):
+        return self.policy == "majority"
+
+    # Cache this window's verdicts and combine them with the cached ones; returns (blocked, scores)
+    def verdict(self, valid, scores):
+        self.history.append((valid, scores))
+        self.history = self.history[-(self.window_turns + 1):]
+        if self.policy == "current":
+            return not all(valid.values()), scores
+        combined_scores = {}
+        blocked = False
+        # Fail-fast scans leave out the scanners after a blocking one, so a window may lack some names
+        for name in dict.fromkeys(name for _, s in self.history for name in s):
+            window_scores = [s[name] for _, s in self.history if name in s]
+            window_blocks = [not v[name] for v, _ in self.history if name in v]
+            if self.policy == "max":
+                combined_scores[name] = max(window_scores)
+                blocked = blocked or any(window_blocks)
+            else:
+                combined_scores[name] = round(sum(window_scores) / len(window_scores), 2)
+                blocked = blocked or sum(window_blocks) * 2 > len(window_blocks)
+        return blocked, combined_scores
+
+class ContextScanReport:
+    # Agreement between incremental verdicts and the full-rescan baseline, plus scanned text sizes
+    def __init__(self):
+        self.turns = 0
+        self.agree = 0
+        self.incremental_only_blocks = 0
+        self.full_only_blocks = 0
+        self.incremental_chars = 0
+        self.full_chars = 0
+        self.incremental_time = 0.0
+        self.full_time = 0.0
+
+    def add(self, incremental_blocked, full_blocked, incremental_chars, full_chars, incremental_time, full_time):
+        self.turns += 1
+        if incremental_blocked == full_blocked:
+            self.agree += 1
+        elif incremental_blocked:
+            self.incremental_only_blocks += 1
+        else:
+            self.full_only_blocks += 1
+        self.incremental_chars += incremental_chars
+        self.full_chars += full_chars
+        self.incremental_time += incremental_time
+        self.full_time += full_time
+
+    def summary(self):
+        return {
+            "turns": self.turns,
+            "agreement": self.agree / self.turns if self.turns else 0.0,
+            "incremental_only_blocks": self.incremental_only_blocks,
+            "full_only_blocks": self.full_only_blocks,
+            "incremental_chars": self.incremental_chars,
+            "full_chars": self.full_chars,
+            "incremental_scan_time": self.incremental_time,
+            "full_scan_time": self.full_time
+        }
+
+    def report(self, path="context_scan_report.json"):
+        summary = self.summary()
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Context scanning: {summary['agreement']:.1%} agreement with full rescan over {self.turns} turns "
+              f"({self.incremental_only_blocks} extra blocks, {self.full_only_blocks} missed blocks); "
+              f"scanned {self.incremental_chars} vs {self.full_chars} characters, "
+              f"{self.incremental_time:.1f}s vs {self.full_time:.1f}s. Report saved to {path}")
+
+# Shared by every conversation of a run when DEFAULT_CONTEXT_COMPARE is set
+context_report = ContextScanReport() if DEFAULT_CONTEXT_COMPARE else None
+
+def new_scan_state():
+    if DEFAULT_CONTEXT_WINDOW < 0:
+        return None
+    return ConversationScanState(DEFAULT_CONTEXT_WINDOW, DEFAULT_CONTEXT_POLICY)
+
+# Text the input scanners see for a turn: the sliding window, or the full history without a state
+def turn_scan_text(state, context, turn):
+    if state is None:
+        return prompt_with_context(context, turn)
+    return state.scan_text(context, turn)
+
+# Turn the scan of turn_scan_text() into the scan_input() triple. With a state the prompt
+# passed on to the model is still the full history (the scanners in use do not rewrite text).
+def finish_turn_scan(state, context, turn, scan_text, scan_result, full_scan=None):
+    sanitized_prompt, input_results_valid, input_risk_scores, input_scan_time = scan_result
+    if state is None:
+        if not all(input_results_valid.values()):
+            return None, input_risk_scores, input_scan_time
+        return sanitized_prompt, input_risk_scores, input_scan_time
+    blocked, combined_scores = state.verdict(input_results_valid, input_risk_scores)
+    full_prompt = prompt_with_context(context, turn)
+    if context_report is not None and full_scan is not None:
+        _, full_valid, _, full_time = full_scan
+        context_report.add(blocked, not all(full_valid.values()), len(scan_text), len(full_prompt), input_scan_time, full_time)
+    if blocked:
+        return None, combined_scores, input_scan_time
+    return full_prompt, combined_scores, input_scan_time
+
+# Scan one conversation turn in-process
+def scan_turn(state, context, turn):
+    if state is None:
+        return scan_input(prompt_with_context(context, turn))
+    scan_text = turn_scan_text(state, context, turn)
+    full_scan = scan_input_verdicts(prompt_with_context(context, turn)) if context_report is not None else None
+    return finish_turn_scan(state, context, turn, scan_text, scan_input_verdicts(scan_text, state.full_scores()), full_scan)
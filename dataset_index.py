@@ -0,0 +1,259 @@
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+# Compact on-disk index of a dataset (<dataset file>.idx): fixed-size row records pointing into a
+# deduplicated UTF-8 string heap, read through mmap so only the rows that are used get decoded.
+# Layout: magic, offset of the JSON header, string heap, row tables, JSON header.
+MAGIC = b"LLMTIDX1"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sQ")
+CELL = "QI"  # heap offset and byte length of one value
+DEDUP_BYTES = 64  # longer values are rarely repeated
+
+HARMFULQA_PATH = "harmfuldataset.json"
+TOXICCHAT_PATH = "toxic-chat/data/0124/toxic-chat_annotation_test.csv"
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class IndexWriter:
+    # Strings are appended to the file as rows are added; row records are written after the heap.
+    # Each process writes its own temporary file, so processes indexing the same dataset at once
+    # (shards, queued jobs) do not clash; the last one to finish installs its index.
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(PREAMBLE.pack(MAGIC, 0))
+        self.heap_offset = self.file.tell()
+        self.heap_size = 0
+        self.strings = {}
+        self.tables = {}
+
+    # Short values (types, topics, categories) are stored once
+    def add_string(self, value):
+        cell = self.strings.get(value)
+        if cell is None:
+            data = value.encode("utf-8")
+            cell = (self.heap_size, len(data))
+            self.file.write(data)
+            self.heap_size += len(data)
+            if len(data) <= DEDUP_BYTES:
+                self.strings[value] = cell
+        return cell
+
+    # json_columns hold JSON-encoded values (ids keep their type, conversation turns their structure)
+    def add_table(self, name, columns, rows, json_columns=()):
+        records = bytearray()
+        record = struct.Struct("<" + CELL * len(columns))
+        count = 0
+        for row in rows:
+            cells = []
+            for column in columns:
+                value = row.get(column)
+                text = json.dumps(value, ensure_ascii=False) if column in json_columns else ("" if value is None else str(value))
+                cells.extend(self.add_string(text))
+            records += record.pack(*cells)
+            count += 1
+        self.tables[name] = {"columns": list(columns), "json_columns": list(json_columns), "rows": count, "records": records}
+
+    def close(self):
+        stat = os.stat(self.source)
+        tables = {}
+        for name, table in self.tables.items():
+            tables[name] = {key: value for key, value in table.items() if key != "records"}
+            tables[name]["offset"] = self.file.tell()
+            self.file.write(table["records"])
+        header_offset = self.file.tell()
+        self.file.write(json.dumps({"version": VERSION, "source": os.path.abspath(self.source), "source_size": stat.st_size,
+                                    "source_mtime_ns": stat.st_mtime_ns, "heap_offset": self.heap_offset,
+                                    "tables": tables}).encode("utf-8"))
+        self.file.seek(0)
+        self.file.write(PREAMBLE.pack(MAGIC, header_offset))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class IndexTable:
+    # Read-only view of one table; rows are decoded into dicts on access
+    def __init__(self, index, spec, columns=None, rows=None):
+        self.index = index
+        self.spec = spec
+        self.record = struct.Struct("<" + CELL * len(spec["columns"]))
+        self.positions = {column: i for i, column in enumerate(spec["columns"])}
+        self.json_columns = set(spec["json_columns"])
+        self.columns = columns or spec["columns"]
+        self.rows = rows  # row numbers of a filtered view, None for the whole table
+
+    def __len__(self):
+        return self.spec["rows"] if self.rows is None else len(self.rows)
+
+    def row_number(self, i):
+        return i if self.rows is None else self.rows[i]
+
+    def value(self, row_number, column):
+        cells = self.record.unpack_from(self.index.mm, self.spec["offset"] + row_number * self.record.size)
+        pos = self.positions[column]
+        start = self.index.heap_offset + cells[2 * pos]
+        text = self.index.mm[start:start + cells[2 * pos + 1]].decode("utf-8")
+        return json.loads(text) if column in self.json_columns else text
+
+    def row(self, row_number):
+        return {column: self.value(row_number, column) for column in self.columns}
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.row(self.row_number(i)) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return self.row(self.row_number(key))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(self.row_number(i))
+
+    # Rows whose column value satisfies predicate; only that column is decoded to decide
+    def where(self, column, predicate):
+        rows = [self.row_number(i) for i in range(len(self)) if predicate(self.value(self.row_number(i), column))]
+        return IndexTable(self.index, self.spec, self.columns, rows)
+
+class DatasetIndex:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_offset = PREAMBLE.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dataset index")
+        self.header = json.loads(self.mm[header_offset:].decode("utf-8"))
+        self.heap_offset = self.header["heap_offset"]
+
+    def table(self, name):
+        return IndexTable(self, self.header["tables"][name])
+
+    def is_current(self, source):
+        stat = os.stat(source)
+        return (self.header.get("version") == VERSION and self.header.get("source_size") == stat.st_size
+                and self.header.get("source_mtime_ns") == stat.st_mtime_ns)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+# HarmfulQA: the flattened prompt table load_harmfulqa() has always produced, the questions the
+# unprotected runner sends, and the conversation chains of the guarded runner. Rows are generated
+# while the table is written so the ingest does not hold a second copy of the dataset.
+def harmfulqa_prompt_rows(data):
+    for entry in data:
+        category = f"{entry['topic']}/{entry['subtopic']}"
+        yield {"type": "question", "id": f"{entry['id']}_question", "topic": entry["topic"], "subtopic": entry["subtopic"],
+               "prompt": entry["question"], "category": category, "hash": content_hash(entry["question"])}
+        for color in ["blue", "red"]:
+            for conv_id, conv in entry.get(f"{color}_conversations", {}).items():
+                for i, turn in enumerate(conv):
+                    if turn["from"] == "human":
+                        yield {"type": f"{color}_conversation", "id": f"{entry['id']}_{color}_{conv_id}_{i}",
+                               "topic": entry["topic"], "subtopic": entry["subtopic"], "prompt": turn["value"],
+                               "category": f"{category}/{color}_{conv_id}", "hash": content_hash(turn["value"])}
+
+def harmfulqa_question_rows(data):
+    for entry in data:
+        yield {"id": entry.get("id"), "question": entry.get("question"), "topic": entry["topic"], "subtopic": entry["subtopic"]}
+
+def harmfulqa_chain_rows(data):
+    for entry in data:
+        for conv_type in ["blue_conversations", "red_conversations"]:
+            for conv_id, conv in entry.get(conv_type, {}).items():
+                yield {"entry_id": entry["id"], "conv_type": conv_type, "conv_id": conv_id, "topic": entry["topic"],
+                       "subtopic": entry["subtopic"], "category": f"{entry['topic']}/{entry['subtopic']}/{conv_type}_{conv_id}",
+                       "turns": conv}
+
+def build_harmfulqa_index(source, path):
+    with open(source, "r") as f:
+        data = json.load(f)
+    writer = IndexWriter(path, source)
+    try:
+        writer.add_table("prompts", ["type", "id", "topic", "subtopic", "prompt", "category", "hash"], harmfulqa_prompt_rows(data))
+        writer.add_table("questions", ["id", "question", "topic", "subtopic"], harmfulqa_question_rows(data), json_columns=("id", "question"))
+        writer.add_table("chains", ["entry_id", "conv_type", "conv_id", "topic", "subtopic", "category", "turns"],
+                         harmfulqa_chain_rows(data), json_columns=("entry_id", "turns"))
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+
+# ToxicChat: the CSV rows as they are, plus a content hash of user_input
+def build_toxicchat_index(source, path):
+    writer = IndexWriter(path, source)
+    try:
+        with open(source, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            columns = list(reader.fieldnames) + ["hash"]
+            writer.add_table("rows", columns, (dict(row, hash=content_hash(row.get("user_input") or "")) for row in reader))
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+
+# Dataset labels of a ToxicChat row, used as its category
+def toxicchat_category(row):
+    category = "toxic" if row.get("toxicity") == "1" else "non-toxic"
+    return category + "/jailbreaking" if row.get("jailbreaking") == "1" else category
+
+BUILDERS = {
+    "harmfulqa": build_harmfulqa_index,
+    "toxicchat": build_toxicchat_index
+}
+
+# The index at path if it is up to date with the dataset, else None
+def current_index(source, path):
+    if not os.path.exists(path):
+        return None
+    index = DatasetIndex(path)
+    if index.is_current(source):
+        return index
+    index.close()
+    return None
+
+# Open the index of a dataset file, building it first if it is missing or older than the dataset
+def open_index(source, kind):
+    path = source + ".idx"
+    index = current_index(source, path)
+    if index is not None:
+        return index
+    print(f"Indexing {source} (one-time step)...")
+    try:
+        BUILDERS[kind](source, path)
+    except OSError:
+        # Another process building the same index may have installed it already
+        index = current_index(source, path)
+        if index is None:
+            raise
+        return index
+    return DatasetIndex(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped dataset indexes used by the runners.")
+    parser.add_argument("--harmfulqa", default=HARMFULQA_PATH)
+    parser.add_argument("--toxicchat", default=TOXICCHAT_PATH)
+    args = parser.parse_args()
+    for kind, source in [("harmfulqa", args.harmfulqa), ("toxicchat", args.toxicchat)]:
+        if not os.path.exists(source):
+            print(f"{source} not found, skipping")
+            continue
+        BUILDERS[kind](source, source + ".idx")
+        index = DatasetIndex(source + ".idx")
+        sizes = ", ".join(f"{name}: {table['rows']} rows" for name, table in index.header["tables"].items())
+        print(f"Indexed {source} -> {source}.idx ({sizes})")
+        index.close()
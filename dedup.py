@@ -0,0 +1,120 @@
+import hashlib
+import os
+import re
+import unicodedata
+
+# off, exact (normalized text) or near (exact plus SimHash near-duplicate clustering)
+DEFAULT_DEDUP = os.environ.get("LLM_TESTER_DEDUP", "off")
+NEAR_DUP_DISTANCE = int(os.environ.get("LLM_TESTER_NEAR_DUP_DISTANCE", "3"))  # max differing SimHash bits
+NEAR_DUP_MIN_TOKENS = 8  # shorter texts are only deduplicated exactly
+DEDUP_MODES = ("off", "exact", "near")
+
+def normalize(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+def exact_key(text):
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+# 64-bit SimHash over word trigrams: texts that share most of their trigrams differ in few bits
+def simhash(tokens):
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+class DedupPlan:
+    # Which prompts are sent (representatives, in first-seen order) and which copy their verdicts
+    def __init__(self, count):
+        self.representatives = []
+        self.duplicates = {}  # representative index -> [(duplicate index, "exact" or "near")]
+        self.count = count
+
+    def add(self, idx, representative=None, kind="exact"):
+        if representative is None:
+            self.representatives.append(idx)
+        else:
+            self.duplicates.setdefault(representative, []).append((idx, kind))
+
+    def duplicates_of(self, idx):
+        return self.duplicates.get(idx, [])
+
+    def counts(self):
+        kinds = [kind for dups in self.duplicates.values() for _, kind in dups]
+        return kinds.count("exact"), kinds.count("near")
+
+def plan_dedup(texts, mode=DEFAULT_DEDUP, distance=NEAR_DUP_DISTANCE):
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode '{mode}', expected one of {', '.join(DEDUP_MODES)}")
+    plan = DedupPlan(len(texts))
+    if mode == "off":
+        plan.representatives = list(range(len(texts)))
+        return plan
+    seen = {}
+    # Near duplicates are found through bands of the SimHash: with distance + 1 bands, two hashes
+    # at most distance bits apart agree on at least one whole band
+    bands = distance + 1
+    band_bits = 64 // bands
+    buckets = {}
+    fingerprints = {}
+    for idx, text in enumerate(texts):
+        key = exact_key(text)
+        if key in seen:
+            plan.add(idx, seen[key], "exact")
+            continue
+        representative = None
+        tokens = normalize(text).split()
+        if mode == "near" and len(tokens) >= NEAR_DUP_MIN_TOKENS:
+            fingerprint = simhash(tokens)
+            band_keys = [(band, fingerprint >> (band * band_bits) & ((1 << band_bits) - 1)) for band in range(bands)]
+            for band_key in band_keys:
+                for candidate in buckets.get(band_key, ()):
+                    if bin(fingerprint ^ fingerprints[candidate]).count("1") <= distance:
+                        representative = candidate
+                        break
+                if representative is not None:
+                    break
+            if representative is None:
+                fingerprints[idx] = fingerprint
+                for band_key in band_keys:
+                    buckets.setdefault(band_key, []).append(idx)
+        if representative is None:
+            seen[key] = idx
+        plan.add(idx, representative, "near")
+    return plan
+
+class DedupStats:
+    # Calls that duplicates did not make because they reused their representative's verdict
+    def __init__(self):
+        self.items = 0
+        self.unique = 0
+        self.exact = 0
+        self.near = 0
+        self.llm_calls_saved = 0
+        self.scanner_calls_saved = 0
+
+    def add_plan(self, plan):
+        exact, near = plan.counts()
+        self.items += plan.count
+        self.unique += len(plan.representatives)
+        self.exact += exact
+        self.near += near
+
+    # metrics of the representative's query (see instrumentation.prompt_metrics)
+    def add_saved(self, metrics, copies=1):
+        metrics = metrics or {}
+        if metrics.get("attempts") and not metrics.get("cached"):
+            self.llm_calls_saved += copies
+        self.scanner_calls_saved += copies * sum(entry["calls"] for entry in metrics.get("scanners", {}).values())
+
+    def report(self, label="prompts"):
+        if self.items == 0 or self.items == self.unique:
+            return None
+        return (f"Dedup: {self.items} {label} -> {self.unique} unique ({self.exact} exact and {self.near} near duplicates); "
+                f"saved {self.llm_calls_saved} LLM calls and {self.scanner_calls_saved} scanner calls")
+
+def add_dedup_arguments(parser):
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP,
+                        help="Query each normalized prompt once (exact) or also merge near-duplicates (near) and copy the verdict to every id")
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import instrument_scanners, merge_timings, with_scan_timings
+from scan_orchestrator import ScanOrchestrator
+from scanner_registry import llm_guard, registry
+
+# Comma-separated in LLM_TESTER_BANNED_TOPICS
+BANNED_TOPICS = [topic.strip() for topic in os.environ.get("LLM_TESTER_BANNED_TOPICS", "violence,illegal activities,hate speech,gambling").split(",")
+                 if topic.strip()]
+SCANNER_THRESHOLD = float(os.environ.get("LLM_TESTER_SCANNER_THRESHOLD", "0.5"))
+# Send conversation turns as a growing role-tagged message list (1) or as one flattened user message (0)
+MULTI_TURN_CHAT = os.environ.get("LLM_TESTER_MULTI_TURN", "1") == "1"
+# Streamed responses are scanned for toxicity every this many generated tokens
+STREAM_SCAN_TOKENS = int(os.environ.get("LLM_TESTER_STREAM_SCAN_TOKENS", "32"))
+
+# Scanners are built on first use so that worker processes only load the models they need.
+# Their model load and scan() times are recorded by instrumentation.
+_input_scanners = None
+_output_scanners = None
+# Runs the input scanners in full or fail-fast mode, optionally in threads (see scan_orchestrator.py)
+input_scan = ScanOrchestrator("input")
+
+# Builders of the llm_guard scanners; backend is use_onnx=True when the onnx backend is selected
+def build_prompt_injection(**backend):
+    return llm_guard().input_scanners.PromptInjection(threshold=SCANNER_THRESHOLD, **backend)
+
+def build_toxicity(**backend):
+    return llm_guard().input_scanners.Toxicity(threshold=SCANNER_THRESHOLD, **backend)
+
+def build_ban_topics(**backend):
+    return llm_guard().input_scanners.BanTopics(topics=BANNED_TOPICS, threshold=SCANNER_THRESHOLD, **backend)
+
+def build_output_toxicity(**backend):
+    return llm_guard().output_scanners.Toxicity(threshold=SCANNER_THRESHOLD, **backend)
+
+# The output Toxicity scanner only wraps an input Toxicity scanner, so once built it is given the
+# shared one and its own copy of the model is freed. If this llm_guard version keeps the model
+# elsewhere, the scanner keeps its own.
+def output_toxicity():
+    scanner = registry.load("output_toxicity", build_output_toxicity)
+    if not isinstance(getattr(scanner, "_scanner", None), llm_guard().input_scanners.Toxicity):
+        print("Output Toxicity scanner does not wrap an input Toxicity scanner in this llm_guard version, keeping its own model")
+        return scanner
+    scanner._scanner = registry.scanner("toxicity", build_toxicity)
+    return scanner
+
+def get_input_scanners():
+    global _input_scanners
+    if _input_scanners is None:
+        llm_guard()  # imported first so its import time is not counted as a model load
+        _input_scanners = instrument_scanners("input", [
+            lambda: registry.scanner("prompt_injection", build_prompt_injection),  # Detect prompt injections
+            lambda: registry.scanner("toxicity", build_toxicity),                  # Detect toxic inputs
+            lambda: registry.scanner("ban_topics", build_ban_topics)               # Block harmful topics
+        ])
+    return _input_scanners
+
+# Scanner setup recorded with each run in the results database
+def scanner_config():
+    return {"threshold": SCANNER_THRESHOLD, "banned_topics": BANNED_TOPICS, "backend": registry.backend,
+            "input": ["PromptInjection", "Toxicity", "BanTopics"], "output": ["Toxicity"],
+            "scan_mode": input_scan.mode, "scan_threads": input_scan.threads}
+
+def get_output_scanners():
+    global _output_scanners
+    if _output_scanners is None:
+        llm_guard()
+        _output_scanners = instrument_scanners("output", [
+            output_toxicity  # Check for toxic outputs
+        ])
+    return _output_scanners
+
+# Scan a prompt with the input scanners, keeping the per-scanner verdicts. In fail-fast mode the
+# scanners after a blocking one are skipped and have no verdict; full=True scans with all of them.
+def scan_input_verdicts(prompt, full=False):
+    start_time = time.perf_counter()
+    sanitized_prompt, input_results_valid, input_risk_scores = input_scan.scan(get_input_scanners(), prompt, full)
+    return sanitized_prompt, input_results_valid, input_risk_scores, time.perf_counter() - start_time
+
+# Scan a prompt with the input scanners; returns None for the sanitized prompt if it is blocked
+def scan_input(prompt):
+    sanitized_prompt, input_results_valid, input_risk_scores, input_scan_time = scan_input_verdicts(prompt)
+    if not all(input_results_valid.values()):
+        return None, input_risk_scores, input_scan_time
+    return sanitized_prompt, input_risk_scores, input_scan_time
+
+# Scan a model response with the output scanners
+def scan_response(sanitized_prompt, output_text):
+    scanned_output, output_results_valid, output_risk_scores = llm_guard().scan_output(get_output_scanners(), sanitized_prompt, output_text)
+    return scanned_output, all(output_results_valid.values()), output_risk_scores
+
+# In-process segment scans run on this thread, off the event loop so other streams keep flowing,
+# one at a time so the scanner timings of each scan stay apart
+_segment_executor = None
+
+def segment_executor():
+    global _segment_executor
+    if _segment_executor is None:
+        _segment_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-scan")
+    return _segment_executor
+
+class ToxicSpanStop:
+    # Stop check for streamed responses: scans each new segment of the response with the output
+    # scanners and stops generation at the first toxic segment. A response that streams to the
+    # end still gets the usual full output scan. timings holds the scanner timings of the segment scans.
+    # A segment's check returns an awaitable, since the scan runs in executor().
+    def __init__(self, sanitized_prompt, every_tokens=STREAM_SCAN_TOKENS):
+        self.sanitized_prompt = sanitized_prompt
+        self.every_tokens = max(1, every_tokens)
+        self.next_check = self.every_tokens
+        self.scanned_to = 0
+        self.output_scores = None
+        self.timings = None
+
+    def next_segment(self, text, tokens):
+        if tokens < self.next_check:
+            return None
+        self.next_check = tokens + self.every_tokens
+        segment = text[self.scanned_to:]
+        self.scanned_to = len(text)
+        return segment
+
+    def record(self, output_scan):
+        scanned_output, output_valid, output_risk_scores = output_scan
+        if output_valid:
+            return None
+        self.output_scores = output_risk_scores
+        return "toxic"
+
+    def executor(self):
+        return segment_executor()
+
+    async def scan_segment(self, segment):
+        loop = asyncio.get_running_loop()
+        output_scan, timings = await loop.run_in_executor(self.executor(), with_scan_timings, scan_response, self.sanitized_prompt, segment)
+        self.timings = merge_timings(self.timings, timings)
+        return self.record(output_scan)
+
+    def __call__(self, text, tokens):
+        segment = self.next_segment(text, tokens)
+        if segment is None:
+            return None
+        return self.scan_segment(segment)
+
+# The output scan of a response that a ToxicSpanStop cut short, or None if it needs a full scan
+def early_output_scan(query_result, stop):
+    if stop is None or stop.output_scores is None or query_result["error"] is not None:
+        return None
+    return query_result["content"], False, stop.output_scores
+
+# Combine a query result and its output scan into the (response, input_scores, output_scores,
+# input_scan_time, query_time) tuple used by the guarded runner
+def guarded_outcome(query_result, output_scan, input_risk_scores, input_scan_time):
+    if query_result["error"] is not None:
+        return f"Error: {query_result['error']}", {}, {}, input_scan_time, 0
+    scanned_output, output_valid, output_risk_scores = output_scan
+    if not output_valid:
+        return "Blocked", input_risk_scores, output_risk_scores, input_scan_time, query_result["query_time"]
+    return scanned_output, input_risk_scores, output_risk_scores, input_scan_time, query_result["query_time"]
+
+# Flatten the conversation history plus the new human turn into one prompt
+def prompt_with_context(context, turn):
+    return "\n".join([f"{t['from']}: {t['value']}" for t in context] + [f"human: {turn['value']}"])
+
+# Messages sent to the model for a conversation turn. In multi-turn mode the history is replayed
+# as user/assistant messages so each request extends the previous one and Ollama can reuse the
+# cached prompt prefix; otherwise the scanned, flattened prompt goes out as a single user message.
+def conversation_messages(context, turn, sanitized_prompt):
+    if not MULTI_TURN_CHAT:
+        return [{'role': 'user', 'content': sanitized_prompt}]
+    messages = [{'role': 'user' if t['from'] == 'human' else 'assistant', 'content': t['value']} for t in context]
+    messages.append({'role': 'user', 'content': turn['value']})
+    return messages
+
+# Append a turn result and extend the conversation history with the (possibly blocked) reply.
+# metrics holds the token counters of the model response, if the turn reached the model.
+def record_turn(conversation_results, context, i, turn, response, input_risk_scores, output_risk_scores, input_scan_time, query_time, metrics=None):
+    metrics = metrics or {}
+    conversation_results.append({
+        "turn": i,
+        "prompt": turn["value"],
+        "response": response,
+        "input_scores": input_risk_scores,
+        "output_scores": output_risk_scores,
+        "input_scan_time": input_scan_time,
+        "query_time": query_time,
+        "prompt_eval_count": metrics.get("prompt_eval_count"),
+        "prompt_eval_duration": metrics.get("prompt_eval_duration"),
+        "eval_count": metrics.get("eval_count"),
+        "stop_reason": metrics.get("stop_reason"),
+        "metrics": metrics
+    })
+    context.append({"from": "human", "value": turn["value"]})
+    context.append({"from": "gpt", "value": response})
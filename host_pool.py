@@ -0,0 +1,239 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import time
+import httpx
+import ollama
+from adaptive_concurrency import ADAPTIVE_CONCURRENCY, AdaptiveLimit
+
+# Comma-separated Ollama hosts, each optionally with its own in-flight limit: "http://box1:11434=4,http://box2:11434=2"
+DEFAULT_HOSTS = os.environ.get("LLM_TESTER_HOSTS", "")
+HEALTH_CHECK_INTERVAL = float(os.environ.get("LLM_TESTER_HEALTH_INTERVAL", "15"))  # seconds between probes of ejected hosts
+HEALTH_CHECK_TIMEOUT = 5.0
+MAX_HOST_FAILURES = int(os.environ.get("LLM_TESTER_MAX_HOST_FAILURES", "3"))  # consecutive server errors before ejection
+NO_HOST_TIMEOUT = float(os.environ.get("LLM_TESTER_NO_HOST_TIMEOUT", "300"))  # give up when no host is healthy for this long
+AFFINITY_ENTRIES = 10000
+
+class HostUnavailable(Exception):
+    # Raised out of a slot whose host failed and was ejected; the request should be re-queued elsewhere
+    pass
+
+# Connection problems eject a host at once; 5xx responses count towards MAX_HOST_FAILURES
+def is_connection_failure(error):
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+def is_server_failure(error):
+    return isinstance(error, ollama.ResponseError) and error.status_code >= 500
+
+# Failures that mean the host has more requests than it can serve
+def is_overload(error):
+    return isinstance(error, asyncio.TimeoutError) or is_connection_failure(error) or is_server_failure(error)
+
+def parse_hosts(spec, default_limit):
+    hosts = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, limit = item.partition("=")
+        hosts.append((url, int(limit) if limit else default_limit))
+    return hosts
+
+# Requests of one conversation share their first message, so it identifies the conversation.
+# Only requests with history are pinned: single prompts (and retries of them) go to the least busy
+# host and do not fill the affinity table.
+def affinity_key(messages):
+    if not messages or len(messages) < 2:
+        return None
+    return hashlib.sha1(json.dumps(messages[0], sort_keys=True).encode("utf-8")).hexdigest()
+
+class SingleHost:
+    # One Ollama host with a bounded number of in-flight requests. With adaptive concurrency the
+    # bound follows the host's AdaptiveLimit.
+    def __init__(self, host=None, concurrency=4):
+        self.client = ollama.AsyncClient(host=host)
+        self.concurrency = max(1, concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.adaptive = AdaptiveLimit(host or "ollama", max(1, concurrency)) if ADAPTIVE_CONCURRENCY else None
+        self.outstanding = 0
+        self.changed = asyncio.Condition()
+
+    async def start(self):
+        pass
+
+    # Requests the host takes at once
+    def capacity(self):
+        return self.adaptive.limit if self.adaptive is not None else self.concurrency
+
+    async def stop(self):
+        if self.adaptive is not None:
+            print(self.adaptive.report())
+
+    # sample is an optional dict in which the caller leaves the response ("response") for the
+    # adaptive limit to learn from
+    @contextlib.asynccontextmanager
+    async def slot(self, affinity=None, sample=None):
+        if self.adaptive is None:
+            async with self.semaphore:
+                yield self.client
+            return
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.outstanding < self.adaptive.limit)
+            self.outstanding += 1
+        start = time.perf_counter()
+        try:
+            yield self.client
+        except Exception as e:
+            self.adaptive.observe(time.perf_counter() - start, overloaded=is_overload(e))
+            raise
+        else:
+            self.adaptive.observe(time.perf_counter() - start, (sample or {}).get("response"))
+        finally:
+            async with self.changed:
+                self.outstanding -= 1
+                self.changed.notify_all()
+
+class PoolHost:
+    def __init__(self, url, limit):
+        self.url = url
+        self.limit = max(1, limit)
+        self.client = ollama.AsyncClient(host=url)
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.completed = 0
+        self.errors = 0
+        self.ejections = 0
+        self.adaptive = AdaptiveLimit(url, self.limit) if ADAPTIVE_CONCURRENCY else None
+
+    # Feed a finished request to the adaptive limit, which then sets the host's limit
+    def observe(self, latency, response=None, error=None):
+        if self.adaptive is not None:
+            self.adaptive.observe(latency, response, error is not None and is_overload(error))
+            self.limit = self.adaptive.limit
+
+class HostPool:
+    # Routes each request to the healthy host with the fewest outstanding requests relative to its
+    # limit. Conversations stay on the host that served their first turn while it is healthy.
+    # Failing hosts are ejected, probed every HEALTH_CHECK_INTERVAL and re-admitted when they answer.
+    # One pool serves a whole run (see ollama_engine.Engine), so affinity and host health carry over
+    # from one conversation wave to the next; hosts are probed once at start.
+    def __init__(self, hosts):
+        self.hosts = [PoolHost(url, limit) for url, limit in hosts]
+        self.affinity = collections.OrderedDict()
+        self.changed = None
+        self.health_task = None
+
+    async def start(self):
+        self.changed = asyncio.Condition()
+        await asyncio.gather(*[self.check(host) for host in self.hosts])
+        self.health_task = asyncio.create_task(self.health_loop())
+
+    async def stop(self):
+        if self.health_task is not None:
+            self.health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.health_task
+        for host in self.hosts:
+            if host.adaptive is not None:
+                print(host.adaptive.report())
+        # Only worth reporting when something went wrong
+        if not any(host.errors or host.ejections for host in self.hosts):
+            return
+        for host in self.hosts:
+            state = "healthy" if host.healthy else "ejected"
+            print(f"Host {host.url}: {host.completed} completed, {host.errors} errors, {host.ejections} ejections ({state})")
+
+    async def check(self, host):
+        try:
+            await asyncio.wait_for(host.client.ps(), HEALTH_CHECK_TIMEOUT)
+            healthy = True
+        except Exception:
+            healthy = False
+        async with self.changed:
+            if healthy and not host.healthy:
+                print(f"Host {host.url} is healthy again, re-admitting it")
+            elif not healthy and host.healthy:
+                print(f"Host {host.url} failed its health check, ejecting it")
+                host.ejections += 1
+            host.healthy = healthy
+            if healthy:
+                host.failures = 0
+            self.changed.notify_all()
+
+    # Requests the healthy hosts take at once
+    def capacity(self):
+        return max(1, sum(host.limit for host in self.hosts if host.healthy))
+
+    async def health_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            await asyncio.gather(*[self.check(host) for host in self.hosts if not host.healthy])
+
+    def pick(self, affinity):
+        pinned = self.affinity.get(affinity) if affinity else None
+        if pinned is not None and pinned.healthy:
+            # Wait for the pinned host rather than lose the conversation's cached prefix
+            return pinned if pinned.outstanding < pinned.limit else None
+        candidates = [host for host in self.hosts if host.healthy and host.outstanding < host.limit]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda host: host.outstanding / host.limit)
+
+    def eject(self, host, error):
+        if host.healthy:
+            print(f"Host {host.url} failed ({error}), ejecting it and re-queueing its requests")
+            host.healthy = False
+            host.ejections += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, affinity=None, sample=None):
+        async with self.changed:
+            waiting_since = time.monotonic()
+            while True:
+                host = self.pick(affinity)
+                if host is not None:
+                    break
+                if not any(h.healthy for h in self.hosts) and time.monotonic() - waiting_since > NO_HOST_TIMEOUT:
+                    raise RuntimeError(f"No healthy Ollama host for {NO_HOST_TIMEOUT:.0f}s")
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.changed.wait(), HEALTH_CHECK_INTERVAL)
+            host.outstanding += 1
+            if affinity:
+                self.affinity[affinity] = host
+                self.affinity.move_to_end(affinity)
+                if len(self.affinity) > AFFINITY_ENTRIES:
+                    self.affinity.popitem(last=False)
+        start = time.perf_counter()
+        try:
+            yield host.client
+        except Exception as e:
+            async with self.changed:
+                host.outstanding -= 1
+                host.errors += 1
+                host.observe(time.perf_counter() - start, error=e)
+                if is_connection_failure(e) or is_server_failure(e):
+                    host.failures += 1
+                    if is_connection_failure(e) or host.failures >= MAX_HOST_FAILURES:
+                        self.eject(host, e)
+                self.changed.notify_all()
+            if not host.healthy:
+                raise HostUnavailable(f"{host.url}: {e}") from e
+            raise
+        else:
+            async with self.changed:
+                host.outstanding -= 1
+                host.failures = 0
+                host.completed += 1
+                host.observe(time.perf_counter() - start, (sample or {}).get("response"))
+                self.changed.notify_all()
+
+# Pool over LLM_TESTER_HOSTS when configured, otherwise the single default (or given) host
+def make_router(host=None, concurrency=4):
+    hosts = parse_hosts(DEFAULT_HOSTS, concurrency) if host is None else []
+    if hosts:
+        return HostPool(hosts)
+    return SingleHost(host, concurrency)
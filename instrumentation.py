@@ -0,0 +1,262 @@
+import json
+import os
+import time
+
+# Per-prompt metric records (JSONL) and the end-of-run summary; also enabled by --metrics / --metrics-export
+DEFAULT_METRICS_PATH = os.environ.get("LLM_TESTER_METRICS", "")
+DEFAULT_METRICS_EXPORT = os.environ.get("LLM_TESTER_METRICS_EXPORT", "")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Scanner calls, model loads and fail-fast skipped scans since the last take_scan_timings() in this process
+_scan_timings = {}
+_load_times = {}
+_skipped_scans = {}
+
+def _add_timing(timings, name, wall, cpu, calls=1):
+    entry = timings.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+    entry["wall"] += wall
+    entry["cpu"] += cpu
+    entry["calls"] += calls
+
+def timed_scan(name, scan):
+    def wrapper(*args, **kwargs):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            return scan(*args, **kwargs)
+        finally:
+            _add_timing(_scan_timings, name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+    return wrapper
+
+def record_load_time(name, seconds):
+    _load_times[name] = _load_times.get(name, 0.0) + seconds
+
+# A scan left out after an earlier scanner blocked the prompt, with the scanner's mean time as the estimate saved
+def record_skipped_scan(name, saved, calls=1):
+    entry = _skipped_scans.setdefault(name, {"saved": 0.0, "calls": 0})
+    entry["saved"] += saved
+    entry["calls"] += calls
+
+# Build scanners one by one, timing each model load, and time every scan() call under
+# "<stage>.<scanner class>". The bound method is replaced on the instance so llm_guard
+# still sees the original scanner class (it keys results by class name).
+def instrument_scanners(stage, builders):
+    scanners = []
+    for build in builders:
+        start = time.perf_counter()
+        scanner = build()
+        name = f"{stage}.{type(scanner).__name__}"
+        record_load_time(name, time.perf_counter() - start)
+        scanner.scan = timed_scan(name, scanner.scan)
+        scanners.append(scanner)
+    return scanners
+
+# Drain the timings collected in this process: {"scanners": {name: {wall, cpu, calls}}, "model_load": {name: seconds},
+# "skipped_scans": {name: {saved, calls}}}
+def take_scan_timings():
+    global _scan_timings, _load_times, _skipped_scans
+    timings = {"scanners": _scan_timings, "model_load": _load_times, "skipped_scans": _skipped_scans}
+    _scan_timings = {}
+    _load_times = {}
+    _skipped_scans = {}
+    return timings
+
+# Run a scan function and return its result with the timings it produced; used for scans in
+# worker processes, whose timings would otherwise stay in the worker
+def with_scan_timings(scan, *args):
+    global _scan_timings, _skipped_scans
+    _scan_timings = {}  # model loads are kept: a worker loads its models before its first scan
+    _skipped_scans = {}
+    result = scan(*args)
+    return result, take_scan_timings()
+
+def merge_timings(*timings_list):
+    merged = {"scanners": {}, "model_load": {}, "skipped_scans": {}}
+    for timings in timings_list:
+        if not timings:
+            continue
+        for name, entry in timings.get("scanners", {}).items():
+            _add_timing(merged["scanners"], name, entry["wall"], entry["cpu"], entry["calls"])
+        for name, seconds in timings.get("model_load", {}).items():
+            merged["model_load"][name] = merged["model_load"].get(name, 0.0) + seconds
+        for name, entry in timings.get("skipped_scans", {}).items():
+            skipped = merged["skipped_scans"].setdefault(name, {"saved": 0.0, "calls": 0})
+            skipped["saved"] += entry["saved"]
+            skipped["calls"] += entry["calls"]
+    return merged
+
+def _rate(count, duration_ns):
+    if not count or not duration_ns:
+        return None
+    return count / (duration_ns / 1e9)
+
+# Response metrics of a query plus derived token rates, request details and the scanner timings
+# of the prompt (input, streaming and output scans)
+def prompt_metrics(metrics, query_result=None, *timings):
+    metrics = dict(metrics or {})
+    metrics["prompt_tokens_per_sec"] = _rate(metrics.get("prompt_eval_count"), metrics.get("prompt_eval_duration"))
+    metrics["tokens_per_sec"] = _rate(metrics.get("eval_count"), metrics.get("eval_duration"))
+    if query_result is not None:
+        metrics["query_time"] = query_result.get("query_time")
+        metrics["attempts"] = query_result.get("attempts")
+        metrics["cached"] = query_result.get("cached")
+    metrics.update(merge_timings(*timings))
+    return metrics
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+class Instrumentation:
+    # Collects per-prompt records, writes them as JSONL and summarizes every series at the end of the run.
+    # Series are keyed by (metric name, label), e.g. ("scanner_wall_seconds", "input.BanTopics").
+    def __init__(self):
+        self.enabled = False
+        self.records_file = None
+        self.export_path = None
+        self.series = {}
+        self.started = time.perf_counter()
+
+    def configure(self, metrics_path="", export_path=""):
+        self.enabled = bool(metrics_path or export_path)
+        self.export_path = export_path or None
+        if metrics_path:
+            self.records_file = open(metrics_path, "w", encoding="utf-8")
+        self.started = time.perf_counter()
+
+    def observe(self, name, value, label=""):
+        if not self.enabled or value is None:
+            return
+        self.series.setdefault((name, label), []).append(value)
+
+    # One record per prompt (or conversation turn); metrics comes from prompt_metrics()
+    def record_prompt(self, prompt_id, metrics, input_scan_time=None):
+        if not self.enabled:
+            return
+        metrics = metrics or {}
+        for name, entry in metrics.get("scanners", {}).items():
+            self.observe("scanner_wall_seconds", entry["wall"], name)
+            self.observe("scanner_cpu_seconds", entry["cpu"], name)
+        for name, seconds in metrics.get("model_load", {}).items():
+            self.observe("model_load_seconds", seconds, name)
+        for name, entry in metrics.get("skipped_scans", {}).items():
+            self.observe("scanner_saved_seconds", entry["saved"], name)
+        self.observe("input_scan_seconds", input_scan_time)
+        if not metrics.get("cached"):
+            self.observe("query_seconds", metrics.get("query_time"))
+            for field in ("prompt_eval_duration", "eval_duration", "load_duration"):
+                if metrics.get(field) is not None:
+                    self.observe(field.replace("duration", "seconds"), metrics[field] / 1e9)
+            self.observe("prompt_tokens_per_sec", metrics.get("prompt_tokens_per_sec"))
+            self.observe("tokens_per_sec", metrics.get("tokens_per_sec"))
+        self.observe("eval_count", metrics.get("eval_count"))
+        if self.records_file is not None:
+            record = dict(metrics, id=prompt_id, input_scan_time=input_scan_time)
+            self.records_file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self):
+        summary = {}
+        for (name, label), values in sorted(self.series.items()):
+            summary.setdefault(name, {})[label] = {
+                "count": len(values),
+                "sum": sum(values),
+                "mean": sum(values) / len(values),
+                "max": max(values),
+                **{f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES}
+            }
+        return summary
+
+    # Where the time went: per-scanner wall time next to the model's query time
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\n--- Instrumentation summary ({time.perf_counter() - self.started:.1f}s run) ---")
+        print(f"{'series':<44}{'count':>8}{'total s':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name, labels in summary.items():
+            for label, stats in labels.items():
+                series = f"{name}{{{label}}}" if label else name
+                print(f"{series:<44}{stats['count']:>8}{stats['sum']:>10.2f}{stats['mean']:>10.4f}"
+                      f"{stats['p50']:>10.4f}{stats['p95']:>10.4f}{stats['p99']:>10.4f}")
+        stages = dict((f"scanner {label}", stats["sum"]) for label, stats in summary.get("scanner_wall_seconds", {}).items())
+        if "query_seconds" in summary:
+            stages["LLM query"] = summary["query_seconds"][""]["sum"]
+        total = sum(stages.values())
+        if total > 0:
+            print("Share of scan + query time: " + ", ".join(f"{stage} {seconds / total:.0%}"
+                                                         for stage, seconds in sorted(stages.items(), key=lambda s: -s[1])))
+
+    # Prometheus text exposition (.prom/.txt) or an OpenTelemetry (OTLP/JSON) metrics document (.json)
+    def export(self, path):
+        summary = self.summary()
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(otlp_document(summary), f, indent=2)
+            else:
+                f.write(prometheus_text(summary))
+        print(f"Metrics exported to {path}")
+
+    def finish(self):
+        if not self.enabled:
+            return
+        if self.records_file is not None:
+            self.records_file.close()
+            print(f"Per-prompt metrics saved to {self.records_file.name}")
+        self.print_summary()
+        if self.export_path:
+            self.export(self.export_path)
+
+def _prometheus_labels(label, extra=None):
+    labels = {"name": label} if label else {}
+    labels.update(extra or {})
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def prometheus_text(summary):
+    lines = []
+    for name, labels in summary.items():
+        metric = f"llm_tester_{name}"
+        lines.append(f"# TYPE {metric} summary")
+        for label, stats in labels.items():
+            for q in QUANTILES:
+                lines.append(f"{metric}{_prometheus_labels(label, {'quantile': q})} {stats[f'p{int(q * 100)}']}")
+            lines.append(f"{metric}_sum{_prometheus_labels(label)} {stats['sum']}")
+            lines.append(f"{metric}_count{_prometheus_labels(label)} {stats['count']}")
+    return "\n".join(lines) + "\n"
+
+def otlp_document(summary):
+    now = str(time.time_ns())
+    metrics = []
+    for name, labels in summary.items():
+        data_points = []
+        for label, stats in labels.items():
+            data_points.append({
+                "attributes": [{"key": "name", "value": {"stringValue": label}}] if label else [],
+                "timeUnixNano": now,
+                "count": str(stats["count"]),
+                "sum": stats["sum"],
+                "quantileValues": [{"quantile": q, "value": stats[f"p{int(q * 100)}"]} for q in QUANTILES]
+            })
+        metrics.append({"name": f"llm_tester.{name}", "summary": {"dataPoints": data_points}})
+    return {"resourceMetrics": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "llm-tester"}}]},
+        "scopeMetrics": [{"scope": {"name": "llm_tester"}, "metrics": metrics}]
+    }]}
+
+# Shared by every query in this process; configured from the command line by the runners
+instruments = Instrumentation()
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument("--metrics", default=DEFAULT_METRICS_PATH, metavar="PATH",
+                        help="Write per-prompt timing and token metrics as JSONL and print a summary at the end")
+    parser.add_argument("--metrics-export", default=DEFAULT_METRICS_EXPORT, metavar="PATH",
+                        help="Dump the metric summary in Prometheus text format (.prom) or as OpenTelemetry JSON (.json)")
+
+def instrumentation_from_args(args):
+    instruments.configure(args.metrics, args.metrics_export)
+    return instruments
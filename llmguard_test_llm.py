@@ -1,162 +1,151 @@
-import ollama
-import json
-import csv
+import argparse
+import os
 import time
-from llm_guard import scan_prompt, scan_output
-from llm_guard.input_scanners import PromptInjection, Toxicity, BanTopics
-
-# Initialize LLM Guard scanners
-input_scanners = [
-    PromptInjection(threshold=0.5),  # Detect prompt injections
-    Toxicity(threshold=0.5),         # Detect toxic inputs
-    BanTopics(topics=["violence", "illegal activities", "hate speech", "gambling"], threshold=0.5)  # Block harmful topics
-]
-output_scanners = [
-    Toxicity(threshold=0.5)  # Check for toxic outputs (reuse Toxicity for output)
-]
-
-# Load HarmfulQA dataset
+from batch_scanner import DEFAULT_SCAN_BATCH_SIZE, prescan_batch, clear_prescan
+from dataset_index import open_index
+from dedup import DedupStats, add_dedup_arguments, plan_dedup
+from context_scanner import context_report, new_scan_state, scan_turn, turn_scan_text
+from instrumentation import add_instrumentation_arguments, instrumentation_from_args, instruments, prompt_metrics, take_scan_timings
+from guard_scanners import (MULTI_TURN_CHAT, ToxicSpanStop, get_input_scanners, get_output_scanners, scan_input, scan_response,
+                            early_output_scan, guarded_outcome, conversation_messages, record_turn, scanner_config, input_scan)
+from ollama_engine import (DEFAULT_MODEL, DEFAULT_STREAM, close_engine, engine, response_metrics, run_chat_batch, run_prompt_batch,
+                           set_response_cache)
+from response_cache import add_cache_arguments, cache_from_args
+from result_sink import ResultSink, add_sink_arguments
+from results_db import add_results_db_arguments, guarded_outcome_fields, results_db_from_args, stage_scores
+from sampling import add_sampling_arguments, sampler_from_args
+from scan_orchestrator import ScanSavings
+from scan_pipeline import DEFAULT_SCAN_WORKERS, GuardedPipeline
+from sharding import add_shard_arguments, in_shard, shard_path
+
+# Load HarmfulQA dataset: the flattened prompt table of its memory-mapped index (built on first
+# use), which decodes rows only when they are accessed
 def load_harmfulqa(file_path="harmfuldataset.json"):
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-    except FileNotFoundError:
+    if not os.path.exists(file_path):
         print(f"Error: {file_path} not found. Ensure HarmfulQA dataset is in the correct directory.")
         return []
-    prompts = []
-    for entry in data:
-        # Single harmful question
-        prompts.append({
-            "type": "question",
-            "id": f"{entry['id']}_question",
-            "topic": entry["topic"],
-            "subtopic": entry["subtopic"],
-            "prompt": entry["question"],
-            "category": f"{entry['topic']}/{entry['subtopic']}"
-        })
-        # Blue conversations (benign)
-        for conv_id, conv in entry.get("blue_conversations", {}).items():
-            for i, turn in enumerate(conv):
-                if turn["from"] == "human":
-                    prompts.append({
-                        "type": "blue_conversation",
-                        "id": f"{entry['id']}_blue_{conv_id}_{i}",
-                        "topic": entry["topic"],
-                        "subtopic": entry["subtopic"],
-                        "prompt": turn["value"],
-                        "category": f"{entry['topic']}/{entry['subtopic']}/blue_{conv_id}"
-                    })
-        # Red conversations (harmful)
-        for conv_id, conv in entry.get("red_conversations", {}).items():
-            for i, turn in enumerate(conv):
-                if turn["from"] == "human":
-                    prompts.append({
-                        "type": "red_conversation",
-                        "id": f"{entry['id']}_red_{conv_id}_{i}",
-                        "topic": entry["topic"],
-                        "subtopic": entry["subtopic"],
-                        "prompt": turn["value"],
-                        "category": f"{entry['topic']}/{entry['subtopic']}/red_{conv_id}"
-                    })
-    return prompts
+    return open_index(file_path, "harmfulqa").table("prompts")
 
-# Query with LLM Guard protection
-def query_guarded(prompt):
-    start_time = time.perf_counter()
+# Scan a model response with the output scanners, unless a streaming stop check already blocked it
+def finish_guarded(sanitized_prompt, query_result, input_risk_scores, input_scan_time, stop=None):
+    if query_result["error"] is not None:
+        return guarded_outcome(query_result, None, input_risk_scores, input_scan_time)
+    output_scan = early_output_scan(query_result, stop) or scan_response(sanitized_prompt, query_result["content"])
+    return guarded_outcome(query_result, output_scan, input_risk_scores, input_scan_time)
+
+# One ToxicSpanStop per request when streaming, so toxic responses stop generating early
+def toxic_span_stops(sanitized_prompts):
+    if not DEFAULT_STREAM:
+        return [None] * len(sanitized_prompts)
+    return [ToxicSpanStop(sanitized_prompt) for sanitized_prompt in sanitized_prompts]
+
+# Batched pre-scan of texts that are about to be scanned one by one; a failure here only
+# means the per-prompt scans run unbatched
+def prescan(scanners, texts):
+    if DEFAULT_SCAN_BATCH_SIZE <= 0:
+        return
     try:
-        # Scan input
-        sanitized_prompt, input_results_valid, input_risk_scores = scan_prompt(input_scanners, prompt)
-        input_scan_time = time.perf_counter() - start_time
-        if not all(input_results_valid.values()):
-            return "Blocked", input_risk_scores, {}, input_scan_time, 0
-
-        # Query model
-        query_start = time.perf_counter()
-        response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': sanitized_prompt}])
-        query_time = time.perf_counter() - query_start
-        output_text = response['message']['content']
-
-        # Scan output
-        scanned_output, output_results_valid, output_risk_scores = scan_output(output_scanners, sanitized_prompt, output_text)
-        if not all(output_results_valid.values()):
-            return "Blocked", input_risk_scores, output_risk_scores, input_scan_time, query_time
-
-        return scanned_output, input_risk_scores, output_risk_scores, input_scan_time, query_time
+        prescan_batch(scanners, texts, DEFAULT_SCAN_BATCH_SIZE)
     except Exception as e:
-        return f"Error: {str(e)}", {}, {}, time.perf_counter() - start_time, 0
+        print(f"Batched pre-scan failed, scanning unbatched: {e}")
 
-# Test conversation chains (multi-turn)
-def query_guarded_conversation(conv_id, conv_turns):
-    conversation_results = []
-    context = []  # Maintain conversation history
-    for i, turn in enumerate(conv_turns):
-        if turn["from"] == "human":
+# In fail-fast mode only the first input scanner sees every text, so only it is pre-scanned
+def prescan_inputs(texts):
+    prescan(input_scan.prescan_scanners(get_input_scanners()), texts)
+
+# Response metrics and scanner timings of a guarded query; call right after its output scan
+def guarded_metrics(query_result, input_timings, stop):
+    return prompt_metrics(response_metrics(query_result), query_result, input_timings,
+                          stop.timings if stop is not None else None, take_scan_timings())
+
+# Query many prompts with LLM Guard protection; allowed prompts go through the concurrent engine.
+# Returns (outcome, metrics) pairs: the query_guarded tuple and the response's token counters.
+def query_guarded_detailed(prompts):
+    outcomes = [None] * len(prompts)
+    pending = []
+    prescan_inputs(prompts)
+    for idx, prompt in enumerate(prompts):
+        start_time = time.perf_counter()
+        try:
+            sanitized_prompt, input_risk_scores, input_scan_time = scan_input(prompt)
+        except Exception as e:
+            outcomes[idx] = ((f"Error: {str(e)}", {}, {}, time.perf_counter() - start_time, 0), prompt_metrics({}, None, take_scan_timings()))
+            continue
+        input_timings = take_scan_timings()
+        if sanitized_prompt is None:
+            outcomes[idx] = (("Blocked", input_risk_scores, {}, input_scan_time, 0), prompt_metrics({}, None, input_timings))
+            continue
+        pending.append((idx, sanitized_prompt, input_risk_scores, input_scan_time, input_timings))
+    clear_prescan(get_input_scanners())
+
+    stops = toxic_span_stops([p[1] for p in pending])
+    query_results = run_prompt_batch([p[1] for p in pending],
+                                     stop_check=stops, cache_tag="toxic_span")
+    prescan(get_output_scanners(), [result["content"] for result in query_results if result["error"] is None])
+    for (idx, sanitized_prompt, input_risk_scores, input_scan_time, input_timings), query_result, stop in zip(pending, query_results, stops):
+        try:
+            outcome = finish_guarded(sanitized_prompt, query_result, input_risk_scores, input_scan_time, stop)
+        except Exception as e:
+            outcome = (f"Error: {str(e)}", {}, {}, input_scan_time, query_result["query_time"])
+        outcomes[idx] = (outcome, guarded_metrics(query_result, input_timings, stop))
+    clear_prescan(get_output_scanners())
+    return outcomes
+
+def query_guarded_batch(prompts):
+    return [outcome for outcome, metrics in query_guarded_detailed(prompts)]
+
+# Query with LLM Guard protection
+def query_guarded(prompt):
+    return query_guarded_batch([prompt])[0]
+
+# Test many conversation chains (multi-turn) in lockstep: the n-th human turn of every
+# conversation is sent to the model as one concurrent batch
+def query_guarded_conversations(conversations):
+    all_results = [[] for _ in conversations]
+    contexts = [[] for _ in conversations]  # Maintain conversation history
+    scan_states = [new_scan_state() for _ in conversations]  # Cached window verdicts in incremental mode
+    human_turns = [[(i, turn) for i, turn in enumerate(conv_turns) if turn["from"] == "human"] for conv_turns in conversations]
+    max_turns = max((len(turns) for turns in human_turns), default=0)
+
+    for wave in range(max_turns):
+        wave_turns = [(conv_idx, turns[wave]) for conv_idx, turns in enumerate(human_turns) if wave < len(turns)]
+        # Include context (previous turns, or a sliding window of them in incremental mode)
+        prescan_inputs([turn_scan_text(scan_states[conv_idx], contexts[conv_idx], turn) for conv_idx, (i, turn) in wave_turns])
+        pending = []
+        for conv_idx, (i, turn) in wave_turns:
+            context = contexts[conv_idx]
             start_time = time.perf_counter()
             try:
-                # Include context (previous turns)
-                prompt_with_context = "\n".join([f"{t['from']}: {t['value']}" for t in context] + [f"human: {turn['value']}"])
-                sanitized_prompt, input_results_valid, input_risk_scores = scan_prompt(input_scanners, prompt_with_context)
-                input_scan_time = time.perf_counter() - start_time
-                if not all(input_results_valid.values()):
-                    conversation_results.append({
-                        "turn": i,
-                        "prompt": turn["value"],
-                        "response": "Blocked",
-                        "input_scores": str(input_risk_scores),
-                        "output_scores": "{}",
-                        "input_scan_time": input_scan_time,
-                        "query_time": 0
-                    })
-                    context.append({"from": "human", "value": turn["value"]})
-                    context.append({"from": "gpt", "value": "Blocked"})
-                    continue
-
-                # Query model
-                query_start = time.perf_counter()
-                response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': sanitized_prompt}])
-                query_time = time.perf_counter() - query_start
-                output_text = response['message']['content']
-
-                # Scan output
-                scanned_output, output_results_valid, output_risk_scores = scan_output(output_scanners, sanitized_prompt, output_text)
-                if not all(output_results_valid.values()):
-                    conversation_results.append({
-                        "turn": i,
-                        "prompt": turn["value"],
-                        "response": "Blocked",
-                        "input_scores": str(input_risk_scores),
-                        "output_scores": str(output_risk_scores),
-                        "input_scan_time": input_scan_time,
-                        "query_time": query_time
-                    })
-                    context.append({"from": "human", "value": turn["value"]})
-                    context.append({"from": "gpt", "value": "Blocked"})
-                    continue
-
-                conversation_results.append({
-                    "turn": i,
-                    "prompt": turn["value"],
-                    "response": scanned_output,
-                    "input_scores": str(input_risk_scores),
-                    "output_scores": str(output_risk_scores),
-                    "input_scan_time": input_scan_time,
-                    "query_time": query_time
-                })
-                context.append({"from": "human", "value": turn["value"]})
-                context.append({"from": "gpt", "value": scanned_output})
+                sanitized_prompt, input_risk_scores, input_scan_time = scan_turn(scan_states[conv_idx], context, turn)
+            except Exception as e:
+                record_turn(all_results[conv_idx], context, i, turn, f"Error: {str(e)}", {}, {}, time.perf_counter() - start_time, 0,
+                            metrics=prompt_metrics({}, None, take_scan_timings()))
+                continue
+            input_timings = take_scan_timings()
+            if sanitized_prompt is None:
+                record_turn(all_results[conv_idx], context, i, turn, "Blocked", input_risk_scores, {}, input_scan_time, 0,
+                            metrics=prompt_metrics({}, None, input_timings))
+                continue
+            pending.append((conv_idx, i, turn, sanitized_prompt, input_risk_scores, input_scan_time, input_timings))
+        clear_prescan(get_input_scanners())
+
+        stops = toxic_span_stops([p[3] for p in pending])
+        query_results = run_chat_batch([conversation_messages(contexts[conv_idx], turn, sanitized_prompt)
+                                        for conv_idx, i, turn, sanitized_prompt, _, _, _ in pending],
+                                       stop_check=stops, cache_tag="toxic_span")
+        prescan(get_output_scanners(), [result["content"] for result in query_results if result["error"] is None])
+        for (conv_idx, i, turn, sanitized_prompt, input_risk_scores, input_scan_time, input_timings), query_result, stop in zip(pending, query_results, stops):
+            try:
+                outcome = finish_guarded(sanitized_prompt, query_result, input_risk_scores, input_scan_time, stop)
             except Exception as e:
-                conversation_results.append({
-                    "turn": i,
-                    "prompt": turn["value"],
-                    "response": f"Error: {str(e)}",
-                    "input_scores": "{}",
-                    "output_scores": "{}",
-                    "input_scan_time": time.perf_counter() - start_time,
-                    "query_time": 0
-                })
-                context.append({"from": "human", "value": turn["value"]})
-                context.append({"from": "gpt", "value": f"Error: {str(e)}"})
-    return conversation_results
+                outcome = (f"Error: {str(e)}", {}, {}, input_scan_time, 0)
+            record_turn(all_results[conv_idx], contexts[conv_idx], i, turn, *outcome, metrics=guarded_metrics(query_result, input_timings, stop))
+        clear_prescan(get_output_scanners())
+    return all_results
+
+# Test conversation chains (multi-turn)
+def query_guarded_conversation(conv_id, conv_turns):
+    return query_guarded_conversations([conv_turns])[0]
 
 # Range selection for prompts
 def parse_range_input(user_input, data_len):
@@ -181,10 +170,19 @@ def parse_range_input(user_input, data_len):
     except Exception:
         return None
 
-def select_prompt_range(prompts):
+# range_spec answers the question without asking, e.g. from --range
+def select_prompt_range(prompts, range_spec=None):
     data_len = len(prompts)
     start_idx = None
     end_idx = None
+    if range_spec is not None:
+        parsed = parse_range_input(range_spec, data_len)
+        if parsed is None:
+            print(f"Invalid --range '{range_spec}' for {data_len} scenarios.")
+            exit(1)
+        start_idx, end_idx = parsed
+        print(f"Running scenarios {start_idx} to {end_idx-1}...")
+        return prompts[start_idx:end_idx]
     while True:
         user_input = input("How many scenarios should be tested? (0 for all, 00 to exit, N for first N, start-end for a range): ").strip()
         if user_input == "00":
@@ -215,19 +213,77 @@ def select_prompt_range(prompts):
             continue
     return prompts[start_idx:end_idx]
 
+RESULT_FIELDS = ["id", "type", "category", "prompt", "response", "input_scores", "output_scores", "input_scan_time", "query_time", "model",
+                 "prompt_eval_count", "prompt_eval_duration", "eval_count", "stop_reason", "duplicate_of"]
+# Prompts (or conversations) per in-process batch; results are written after each batch
+CHUNK_SIZE = int(os.environ.get("LLM_TESTER_CHUNK_SIZE", "256"))
+
 # Main testing function
-def test_guarded_model():
-    # Load prompts
+def test_guarded_model(resume=False, shard=None, category=None, dedup="off", results_db=None, sampler=None, range_spec=None,
+                       output="guarded_results.csv"):
+    # Load prompts, optionally only those of one category (topic, topic/subtopic, ...)
     single_prompts = load_harmfulqa()
-    # Ask user for range
-    single_prompts = select_prompt_range(single_prompts)
-    results = []
-
-    # Test single prompts (questions and conversation turns)
-    for idx, p in enumerate(single_prompts):
-        print(f"Testing prompt {idx + 1}/{len(single_prompts)}: {p['prompt'][:50]}...")
-        response, input_scores, output_scores, input_scan_time, query_time = query_guarded(p["prompt"])
-        results.append({
+    if category:
+        single_prompts = single_prompts.where("category", lambda value: value.startswith(category))
+    # Ask user for range; a sampled run draws from all of them unless --range narrows it
+    if sampler is None or range_spec is not None:
+        single_prompts = select_prompt_range(single_prompts, range_spec)
+
+    # Collect conversation chains (blue and red)
+    chain_table = open_index("harmfuldataset.json", "harmfulqa").table("chains")
+    if category:
+        chain_table = chain_table.where("category", lambda value: value.startswith(category))
+    chains = []
+    if sampler is not None:
+        print(f"Sampling {len(single_prompts)} prompts stratified by {', '.join(sampler.fields)}; conversation chains are not sampled.")
+        chain_table = []
+    for chain in chain_table:
+        entry = {"id": chain["entry_id"], "topic": chain["topic"], "subtopic": chain["subtopic"]}
+        chains.append((entry, chain["conv_type"], chain["conv_id"], chain["turns"]))
+
+    # Rows are appended to the CSV as prompts complete; the manifest lists finished prompt and
+    # conversation ids so --resume skips them
+    # With a shard only the prompts and conversations whose ids hash to it are run
+    single_prompts = [p for p in single_prompts if in_shard(p["id"], shard)]
+    chains = [chain for chain in chains if in_shard(f"{chain[0]['id']}_{chain[1]}_{chain[2]}", shard)]
+    if sampler is not None:
+        for p in single_prompts:
+            sampler.assign(p["id"], p)
+    if shard is not None:
+        print(f"Shard {shard[0]}/{shard[1]}: {len(single_prompts)} prompts and {len(chains)} conversation chains.")
+    output_path = shard_path(output, shard)
+    sink = ResultSink(output_path, fieldnames=RESULT_FIELDS, resume=resume)
+    total = len(single_prompts) + len(chains)
+    single_prompts = [p for p in single_prompts if not sink.is_done(p["id"])]
+    chains = [chain for chain in chains if not sink.is_done(f"{chain[0]['id']}_{chain[1]}_{chain[2]}")]
+    if resume and total > len(single_prompts) + len(chains):
+        print(f"Resuming: {total - len(single_prompts) - len(chains)} prompts/conversations already completed in a previous run.")
+    if sampler is not None:
+        single_prompts = sampler.order(single_prompts, lambda p: p["id"])
+
+    # Each unique prompt and conversation is run once and its verdict is written for every id that
+    # shares it. Conversations are only merged when their human turns match exactly, so every turn
+    # of a duplicate has a verdict to copy.
+    prompt_plan = plan_dedup([p["prompt"] for p in single_prompts], dedup)
+    chain_plan = plan_dedup(["\n".join(turn["value"] for turn in chain[3] if turn["from"] == "human") for chain in chains],
+                            "off" if dedup == "off" else "exact")
+    dedup_stats = DedupStats()
+    dedup_stats.add_plan(prompt_plan)
+    dedup_stats.add_plan(chain_plan)
+    scan_savings = ScanSavings("input")
+
+    # Every row also goes to the results database, with the scores as numbers
+    if results_db is not None:
+        results_db.start_run("llmguard_test_llm", "harmfulqa", DEFAULT_MODEL, shard, scanner_config(), resume=resume)
+
+    def record_db(row, input_scores, output_scores):
+        if results_db is not None:
+            results_db.add(dict(row, prompt_id=str(row["id"]), **guarded_outcome_fields(row["response"], output_scores)),
+                           stage_scores(input_scores, output_scores))
+
+    def write_prompt(p, outcome, metrics, duplicate_of=None):
+        response, input_scores, output_scores, input_scan_time, query_time = outcome
+        row = {
             "id": p["id"],
             "type": p["type"],
             "category": p["category"],
@@ -237,37 +293,144 @@ def test_guarded_model():
             "output_scores": str(output_scores),
             "input_scan_time": input_scan_time,
             "query_time": query_time,
-            "model": "guarded"
-        })
-
-    # Test conversation chains (blue and red)
-    with open("harmfuldataset.json", 'r') as f:
-        data = json.load(f)
-    for entry in data:
-        for conv_type in ["blue_conversations", "red_conversations"]:
-            for conv_id, conv in entry.get(conv_type, {}).items():
-                print(f"Testing {conv_type} {entry['id']}_{conv_id}...")
-                conv_results = query_guarded_conversation(f"{entry['id']}_{conv_type}_{conv_id}", conv)
-                for res in conv_results:
-                    results.append({
-                        "id": f"{entry['id']}_{conv_type}_{conv_id}_{res['turn']}",
-                        "type": conv_type,
-                        "category": f"{entry['topic']}/{entry['subtopic']}/{conv_type}_{conv_id}",
-                        "prompt": res["prompt"],
-                        "response": res["response"],
-                        "input_scores": res["input_scores"],
-                        "output_scores": res["output_scores"],
-                        "input_scan_time": res["input_scan_time"],
-                        "query_time": res["query_time"],
-                        "model": "guarded"
-                    })
-
-    # Save results to CSV
-    with open("guarded_results.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["id", "type", "category", "prompt", "response", "input_scores", "output_scores", "input_scan_time", "query_time", "model"])
-        writer.writeheader()
-        writer.writerows(results)
-    print("Guarded model results saved to guarded_results.csv")
+            "model": "guarded",
+            "prompt_eval_count": metrics.get("prompt_eval_count"),
+            "prompt_eval_duration": metrics.get("prompt_eval_duration"),
+            "eval_count": metrics.get("eval_count"),
+            "stop_reason": metrics.get("stop_reason"),
+            "duplicate_of": duplicate_of
+        }
+        sink.write(row)
+        record_db(row, input_scores, output_scores)
+        if sampler is not None and not response.startswith("Error: "):
+            sampler.add(p["id"], response == "Blocked")
+        if duplicate_of is None:
+            instruments.record_prompt(p["id"], metrics, input_scan_time)
+            scan_savings.add(metrics)
+        sink.mark_done(p["id"])
+
+    def write_unique_prompt(idx, outcome, metrics):
+        representative = prompt_plan.representatives[idx]
+        write_prompt(single_prompts[representative], outcome, metrics)
+        duplicates = prompt_plan.duplicates_of(representative)
+        dedup_stats.add_saved(metrics, len(duplicates))
+        for j, kind in duplicates:
+            write_prompt(single_prompts[j], outcome, metrics, duplicate_of=single_prompts[representative]["id"])
+
+    # A duplicate conversation gets the representative's turn results under its own turn numbers
+    def write_conversation(chain, conv_results, duplicate_of=None):
+        entry, conv_type, conv_id, conv = chain
+        human_turns = [(i, turn) for i, turn in enumerate(conv) if turn["from"] == "human"]
+        for (turn_number, turn), res in zip(human_turns, conv_results):
+            row = {
+                "id": f"{entry['id']}_{conv_type}_{conv_id}_{turn_number}",
+                "type": conv_type,
+                "category": f"{entry['topic']}/{entry['subtopic']}/{conv_type}_{conv_id}",
+                "prompt": turn["value"],
+                "response": res["response"],
+                "input_scores": str(res["input_scores"]),
+                "output_scores": str(res["output_scores"]),
+                "input_scan_time": res["input_scan_time"],
+                "query_time": res["query_time"],
+                "model": "guarded",
+                "prompt_eval_count": res["prompt_eval_count"],
+                "prompt_eval_duration": res["prompt_eval_duration"],
+                "eval_count": res["eval_count"],
+                "stop_reason": res["stop_reason"],
+                "duplicate_of": duplicate_of
+            }
+            sink.write(row)
+            record_db(row, res["input_scores"], res["output_scores"])
+            if duplicate_of is None:
+                instruments.record_prompt(f"{entry['id']}_{conv_type}_{conv_id}_{turn_number}", res["metrics"], res["input_scan_time"])
+                scan_savings.add(res["metrics"])
+        sink.mark_done(f"{entry['id']}_{conv_type}_{conv_id}")
+
+    def write_unique_conversation(idx, conv_results):
+        representative = chain_plan.representatives[idx]
+        entry, conv_type, conv_id, conv = chains[representative]
+        write_conversation(chains[representative], conv_results)
+        duplicates = chain_plan.duplicates_of(representative)
+        for res in conv_results:
+            dedup_stats.add_saved(res["metrics"], len(duplicates))
+        for j, kind in duplicates:
+            write_conversation(chains[j], conv_results, duplicate_of=f"{entry['id']}_{conv_type}_{conv_id}")
+
+    unique_prompts = [single_prompts[j] for j in prompt_plan.representatives]
+    unique_chains = [chains[j] for j in chain_plan.representatives]
+
+    # Test single prompts (questions and conversation turns) and conversation chains
+    print(f"Testing {len(unique_prompts)} prompts and {len(unique_chains)} conversation chains...")
+    try:
+        if DEFAULT_SCAN_WORKERS > 0:
+            # Pipelined mode: scanning in worker processes overlaps with generation
+            GuardedPipeline(DEFAULT_SCAN_WORKERS).run(
+                [p["prompt"] for p in unique_prompts], [chain[3] for chain in unique_chains],
+                on_prompt=lambda idx, result: write_unique_prompt(idx, *result),
+                on_conversation=write_unique_conversation, should_stop=sampler.should_stop if sampler is not None else None)
+        else:
+            # A sampled run checks its estimate between smaller chunks
+            chunk_size = CHUNK_SIZE if sampler is None else sampler.round_size
+            for start in range(0, len(unique_prompts), chunk_size):
+                if sampler is not None and start > 0 and sampler.should_stop():
+                    break
+                chunk = unique_prompts[start:start + chunk_size]
+                for offset, (outcome, metrics) in enumerate(query_guarded_detailed([p["prompt"] for p in chunk])):
+                    write_unique_prompt(start + offset, outcome, metrics)
+                print(f"Completed {start + len(chunk)}/{len(unique_prompts)} prompts")
+            # In multi-turn mode only as many conversations as the router has request slots (over all
+            # healthy hosts, at the current adaptive limits) run together, so each one keeps its
+            # server slot (and cached prefix) from turn to turn
+            start = 0
+            while start < len(unique_chains):
+                conv_chunk_size = min(CHUNK_SIZE, engine.capacity()) if MULTI_TURN_CHAT else CHUNK_SIZE
+                chunk = unique_chains[start:start + conv_chunk_size]
+                for offset, conv_results in enumerate(query_guarded_conversations([chain[3] for chain in chunk])):
+                    write_unique_conversation(start + offset, conv_results)
+                start += len(chunk)
+                print(f"Completed {start}/{len(unique_chains)} conversation chains")
+    finally:
+        sink.close()
+        if results_db is not None:
+            results_db.close()
+    print(f"Guarded model results saved to {output_path}")
+    if sampler is not None:
+        sampler.report()
+    if dedup_stats.report("prompts and conversations") is not None:
+        print(dedup_stats.report("prompts and conversations"))
+    if scan_savings.report() is not None:
+        print(scan_savings.report())
+    if context_report is not None:
+        context_report.report()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Test an LLM protected by LLM Guard against the HarmfulQA dataset.")
+    add_cache_arguments(parser)
+    add_sink_arguments(parser)
+    add_shard_arguments(parser)
+    add_instrumentation_arguments(parser)
+    add_dedup_arguments(parser)
+    add_results_db_arguments(parser)
+    add_sampling_arguments(parser, "topic,type")
+    parser.add_argument("--category", default=None, help="Only test prompts and conversations whose category starts with this, e.g. 'Science and Technology/Physics'")
+    parser.add_argument("--range", default=None, metavar="SPEC",
+                        help="Scenarios to run without asking: 0 for all, N for the first N, start-end for a range")
+    parser.add_argument("--output", default="guarded_results.csv", help="CSV file the results are appended to")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cache = cache_from_args(args)
+    instrumentation_from_args(args)
+    set_response_cache(cache)
+    test_guarded_model(resume=args.resume, shard=args.shard, category=args.category, dedup=args.dedup,
+                       results_db=results_db_from_args(args), sampler=sampler_from_args(args, "block rate"),
+                       range_spec=args.range, output=args.output)
+    close_engine()
+    instruments.finish()
+    if cache is not None:
+        print(cache.report())
+        cache.close()
 
 if __name__ == "__main__":
-    test_guarded_model()
\ No newline at end of file
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ollama
+from dataset_index import HARMFULQA_PATH, TOXICCHAT_PATH, open_index, toxicchat_category
+from host_pool import DEFAULT_HOSTS, parse_hosts
+from instrumentation import percentile
+from ollama_engine import DEFAULT_KEEP_ALIVE, close_engine, response_metrics, run_chat_batch, set_response_cache, user_messages
+from refusal_detector import RefusalDetector
+from response_cache import add_cache_arguments, cache_from_args
+from results_db import add_results_db_arguments, results_db_from_args, stage_scores
+from sharding import add_shard_arguments, in_shard, shard_path
+
+# Compare several models (or sampling settings of one model) on the same prompts. The dataset is
+# loaded and, in guarded mode, input-scanned once; generation runs model by model so Ollama loads
+# each model once, and the report puts refusal/block rates and latency side by side.
+
+# "model" or "model#option=value,option=value", e.g. "llama3:8b#temperature=0.7"
+def parse_model_spec(spec, base_options):
+    model, _, option_text = spec.partition("#")
+    options = dict(base_options or {})
+    for item in filter(None, option_text.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            options[key.strip()] = json.loads(value)
+        except ValueError:
+            options[key.strip()] = value
+    return {"label": spec, "model": model, "options": options or None}
+
+def load_prompts(dataset, start, limit, category, shard):
+    if dataset == "harmfulqa":
+        rows = open_index(HARMFULQA_PATH, "harmfulqa").table("questions")
+        prompts = [{"id": str(row["id"]), "type": "question", "prompt": row["question"], "category": f"{row['topic']}/{row['subtopic']}"}
+                   for row in rows]
+    else:
+        rows = open_index(TOXICCHAT_PATH, "toxicchat").table("rows")
+        prompts = [{"id": row["conv_id"], "type": "user_input", "prompt": row["user_input"], "category": toxicchat_category(row)}
+                   for row in rows]
+    prompts = [p for p in prompts if p["prompt"] and (not category or p["category"].startswith(category))]
+    prompts = prompts[start:start + limit] if limit else prompts[start:]
+    return [p for p in prompts if in_shard(p["id"], shard)]
+
+# Order the models so each is loaded once: variants of one model run back to back, starting with
+# models that are already loaded on the server
+def schedule(specs, client):
+    try:
+        loaded = {entry.get("model") or entry.get("name") for entry in client.ps()["models"]}
+    except Exception:
+        loaded = set()
+    first_seen = {}
+    for spec in specs:
+        first_seen.setdefault(spec["model"], len(first_seen))
+    return sorted(specs, key=lambda spec: (spec["model"] not in loaded, first_seen[spec["model"]]))
+
+def ollama_clients():
+    hosts = [url for url, _ in parse_hosts(DEFAULT_HOSTS, 1)] or [None]
+    return [ollama.Client(host=url) for url in hosts]
+
+# An empty generate request loads (keep_alive > 0) or unloads (keep_alive=0) a model; returns seconds
+def set_model_loaded(clients, model, keep_alive):
+    start = time.perf_counter()
+    for client in clients:
+        try:
+            client.generate(model=model, prompt="", keep_alive=keep_alive)
+        except Exception as e:
+            print(f"Could not {'load' if keep_alive else 'unload'} {model}: {e}")
+    return time.perf_counter() - start
+
+class Scanning:
+    # Input/output scans in LLM_TESTER_SCAN_WORKERS processes, or in this process when that is 0
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            from scan_pipeline import init_scan_worker
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_scan_worker)
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def map(self, scan, *arg_lists):
+        if self.pool is not None:
+            return list(self.pool.map(scan, *arg_lists, chunksize=8))
+        return list(map(scan, *arg_lists))
+
+def scan_inputs(scanning, texts):
+    from guard_scanners import get_input_scanners, scan_input
+    from batch_scanner import DEFAULT_SCAN_BATCH_SIZE, clear_prescan, prescan_batch
+    if scanning.pool is None and DEFAULT_SCAN_BATCH_SIZE > 0:
+        try:
+            prescan_batch(get_input_scanners(), texts, DEFAULT_SCAN_BATCH_SIZE)
+        except Exception as e:
+            print(f"Batched pre-scan failed, scanning unbatched: {e}")
+    try:
+        return scanning.map(scan_input, texts)
+    finally:
+        if scanning.pool is None and DEFAULT_SCAN_BATCH_SIZE > 0:
+            clear_prescan(get_input_scanners())
+
+# One model's pass over the prompts; returns a record per prompt (None where the input was blocked)
+def run_model(spec, prompts, input_scans, scanning, detector):
+    from_scan = input_scans is not None
+    allowed = [i for i in range(len(prompts)) if not from_scan or input_scans[i][0] is not None]
+    texts = [input_scans[i][0] if from_scan else prompts[i]["prompt"] for i in allowed]
+    results = run_chat_batch([user_messages(text) for text in texts], model=spec["model"], options=spec["options"],
+                             keep_alive=DEFAULT_KEEP_ALIVE, stream=False)
+    output_scans = {}
+    if from_scan:
+        from guard_scanners import scan_response
+        answered = [n for n, result in enumerate(results) if result["error"] is None]
+        scans = scanning.map(scan_response, [texts[n] for n in answered], [results[n]["content"] for n in answered])
+        output_scans = dict(zip(answered, scans))
+    refusals = detector.detect([result["content"] or "" for result in results])
+    records = [None] * len(prompts)
+    for n, (i, result) in enumerate(zip(allowed, results)):
+        metrics = response_metrics(result)
+        record = {"response": result["content"], "query_time": result["query_time"], "cached": result["cached"],
+                  "eval_count": metrics.get("eval_count"), "eval_duration": metrics.get("eval_duration"),
+                  "prompt_eval_count": metrics.get("prompt_eval_count"), "output_scores": {}}
+        if result["error"] is not None:
+            record.update(verdict="error", error=result["error"])
+        elif n in output_scans and not output_scans[n][1]:
+            record.update(verdict="blocked_output", output_scores=output_scans[n][2])
+        else:
+            record.update(verdict="refusal" if refusals[n] else "answered", output_scores=output_scans[n][2] if n in output_scans else {})
+        records[i] = record
+    return records
+
+VERDICTS = ("blocked_input", "blocked_output", "refusal", "answered", "error")
+
+def summarize(spec, records, load_time):
+    counts = {verdict: 0 for verdict in VERDICTS}
+    for record in records:
+        counts["blocked_input" if record is None else record["verdict"]] += 1
+    timed = [record for record in records if record is not None and record["verdict"] != "error" and not record["cached"]]
+    latencies = [record["query_time"] for record in timed]
+    rates = [record["eval_count"] / (record["eval_duration"] / 1e9) for record in timed if record["eval_count"] and record["eval_duration"]]
+    total = max(1, len(records))
+    return {"label": spec["label"], "model": spec["model"], "options": spec["options"], "prompts": len(records), **counts,
+            "refusal_rate": counts["refusal"] / total, "block_rate": (counts["blocked_input"] + counts["blocked_output"]) / total,
+            "answer_rate": counts["answered"] / total, "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95), "tokens_per_sec": sum(rates) / len(rates) if rates else None,
+            "load_time": load_time}
+
+def print_comparison(summaries, guarded):
+    columns = [("model", "label", "{}"), ("refused", "refusal_rate", "{:.1%}"), ("answered", "answer_rate", "{:.1%}")]
+    if guarded:
+        columns.append(("blocked", "block_rate", "{:.1%}"))
+    columns += [("errors", "error", "{}"), ("p50 s", "latency_p50", "{:.2f}"), ("p95 s", "latency_p95", "{:.2f}"),
+                ("tok/s", "tokens_per_sec", "{:.1f}"), ("load s", "load_time", "{:.1f}")]
+    rows = [[("-" if summary[key] is None else fmt.format(summary[key])) for _, key, fmt in columns] for summary in summaries]
+    widths = [max([len(header)] + [len(row[c]) for row in rows]) for c, (header, _, _) in enumerate(columns)]
+    print("  ".join(header.ljust(width) for (header, _, _), width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+def verdict_of(record):
+    return "blocked_input" if record is None else record["verdict"]
+
+def write_outputs(path, prompts, specs, all_records, summaries, input_scans):
+    disagreements = sum(1 for i in range(len(prompts)) if len({verdict_of(all_records[spec["label"]][i]) for spec in specs}) > 1)
+    report = {"models": summaries, "disagreements": disagreements, "prompts": []}
+    for i, p in enumerate(prompts):
+        report["prompts"].append({**p, "input_scores": input_scans[i][1] if input_scans is not None else None,
+                                  "results": {spec["label"]: all_records[spec["label"]][i] for spec in specs}})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    # Wide CSV: one row per prompt, a verdict and latency column per model
+    with open(os.path.splitext(path)[0] + ".csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "category"] + [f"{spec['label']} {column}" for spec in specs for column in ("verdict", "query_time")])
+        for i, p in enumerate(prompts):
+            cells = []
+            for spec in specs:
+                record = all_records[spec["label"]][i]
+                cells += [verdict_of(record), None if record is None else record["query_time"]]
+            writer.writerow([p["id"], p["category"]] + cells)
+    return disagreements
+
+OUTCOMES = {"blocked_input": ("blocked", "input"), "blocked_output": ("blocked", "output"), "error": ("error", None), "refusal": ("pass", None)}
+
+# Each model becomes a run in the results database, so results_db.py diff compares two models
+def record_runs(results_db, dataset, shard, guarded, prompts, specs, all_records, input_scans):
+    from guard_scanners import scanner_config
+    for spec in specs:
+        results_db.start_run("model_matrix" + ("_guarded" if guarded else ""), dataset, spec["label"], shard,
+                             scanner_config() if guarded else None)
+        for i, p in enumerate(prompts):
+            record = all_records[spec["label"]][i]
+            outcome, blocked_by = OUTCOMES.get(verdict_of(record), ("pass" if guarded else "fail", None))
+            record = record or {}
+            results_db.add({"prompt_id": p["id"], "type": p["type"], "category": p["category"], "prompt": p["prompt"],
+                            "response": record.get("response"), "outcome": outcome, "blocked_by": blocked_by, "error": record.get("error"),
+                            "input_scan_time": input_scans[i][2] if input_scans is not None else None, "query_time": record.get("query_time"),
+                            "prompt_eval_count": record.get("prompt_eval_count"), "eval_count": record.get("eval_count")},
+                           stage_scores(input_scans[i][1] if input_scans is not None else {}, record.get("output_scores")))
+        results_db.finish_run()
+    results_db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare several Ollama models on the same prompts.")
+    parser.add_argument("models", nargs="+", help="Models to compare, optionally with sampling options: llama3 'llama3#temperature=0.7' mistral")
+    parser.add_argument("--dataset", choices=["harmfulqa", "toxicchat"], default="harmfulqa")
+    parser.add_argument("--guarded", action="store_true", help="Scan inputs (once, shared by all models) and outputs with LLM Guard")
+    parser.add_argument("--options", default=None, help="Sampling options for every model as JSON, e.g. '{\"temperature\": 0}'")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=0, help="Number of prompts (0 for all)")
+    parser.add_argument("--category", default=None, help="Only prompts whose category starts with this")
+    parser.add_argument("--keep-loaded", action="store_true", help="Do not unload a model when moving on to the next one")
+    parser.add_argument("--output", default="model_matrix.json")
+    add_cache_arguments(parser)
+    add_shard_arguments(parser)
+    add_results_db_arguments(parser)
+    args = parser.parse_args()
+    cache = cache_from_args(args)
+    set_response_cache(cache)
+
+    specs = [parse_model_spec(spec, json.loads(args.options) if args.options else None) for spec in args.models]
+    prompts = load_prompts(args.dataset, args.start, args.limit, args.category, args.shard)
+    print(f"Comparing {len(specs)} models on {len(prompts)} {args.dataset} prompts")
+    clients = ollama_clients()
+    specs = schedule(specs, clients[0])
+    scan_workers = int(os.environ.get("LLM_TESTER_SCAN_WORKERS", "0"))
+    all_records = {}
+    summaries = []
+    with Scanning(scan_workers if args.guarded else 0) as scanning:
+        input_scans = None
+        if args.guarded:
+            start = time.perf_counter()
+            input_scans = scan_inputs(scanning, [p["prompt"] for p in prompts])
+            blocked = sum(1 for scan in input_scans if scan[0] is None)
+            print(f"Input scan: {blocked} of {len(prompts)} prompts blocked in {time.perf_counter() - start:.1f}s (shared by all models)")
+        detector = RefusalDetector()
+        for n, spec in enumerate(specs):
+            print(f"Running {spec['label']}...")
+            load_time = set_model_loaded(clients, spec["model"], DEFAULT_KEEP_ALIVE)
+            all_records[spec["label"]] = run_model(spec, prompts, input_scans, scanning, detector)
+            close_engine()  # each model gets its own adaptive limits and report
+            summaries.append(summarize(spec, all_records[spec["label"]], load_time))
+            last_use = all(other["model"] != spec["model"] for other in specs[n + 1:])
+            if last_use and n < len(specs) - 1 and not args.keep_loaded:
+                set_model_loaded(clients, spec["model"], 0)
+    output_path = shard_path(args.output, args.shard)
+    disagreements = write_outputs(output_path, prompts, specs, all_records, summaries, input_scans)
+    print()
+    print_comparison(summaries, args.guarded)
+    print(f"\n{disagreements} of {len(prompts)} prompts got different verdicts across models; details in {output_path}")
+    results_db = results_db_from_args(args)
+    if results_db is not None:
+        record_runs(results_db, args.dataset, args.shard, args.guarded, prompts, specs, all_records, input_scans)
+    if cache is not None:
+        print(cache.report())
+        cache.close()
@@ -0,0 +1,260 @@
+import asyncio
+import atexit
+import inspect
+import os
+import random
+import time
+from host_pool import HostUnavailable, affinity_key, make_router
+from response_cache import cache_key, response_to_dict
+
+# Defaults can be overridden from the environment so the interactive scripts stay prompt-free
+DEFAULT_MODEL = os.environ.get("LLM_TESTER_MODEL", "llama3")
+DEFAULT_CONCURRENCY = int(os.environ.get("LLM_TESTER_CONCURRENCY", "4"))  # match OLLAMA_NUM_PARALLEL on the server
+DEFAULT_TIMEOUT = float(os.environ.get("LLM_TESTER_TIMEOUT", "300"))  # seconds per request attempt
+DEFAULT_RETRIES = int(os.environ.get("LLM_TESTER_RETRIES", "2"))
+DEFAULT_BACKOFF = float(os.environ.get("LLM_TESTER_BACKOFF", "1.0"))  # base delay, doubled on every retry
+DEFAULT_KEEP_ALIVE = os.environ.get("LLM_TESTER_KEEP_ALIVE", "30m")  # keep the model (and its prompt cache) loaded between requests
+DEFAULT_STREAM = os.environ.get("LLM_TESTER_STREAM", "0") == "1"  # stream tokens so stop checks can end generation early
+DEFAULT_MAX_TOKENS = int(os.environ.get("LLM_TESTER_MAX_TOKENS", "0"))  # generated-token cap (num_predict); 0 means no cap
+
+# Optional ResponseCache shared by every query in this process (see set_response_cache)
+response_cache = None
+
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+# Build a single-turn message list for a plain prompt
+def user_messages(prompt):
+    return [{'role': 'user', 'content': prompt}]
+
+# Prompt-processing and generation counters reported by Ollama (durations in nanoseconds)
+def response_metrics(query_result):
+    response = query_result.get("response")
+    if response is None:
+        return {}
+    return {
+        "prompt_eval_count": response.get("prompt_eval_count"),
+        "prompt_eval_duration": response.get("prompt_eval_duration"),
+        "eval_count": response.get("eval_count"),
+        "eval_duration": response.get("eval_duration"),
+        "load_duration": response.get("load_duration"),
+        "total_duration": response.get("total_duration"),
+        "stop_reason": response.get("stop_reason") or response.get("done_reason")
+    }
+
+# Apply the generated-token cap to the generation options
+def with_token_cap(options):
+    if DEFAULT_MAX_TOKENS <= 0:
+        return options
+    return dict(options or {}, num_predict=DEFAULT_MAX_TOKENS)
+
+# Stream a chat response, calling stop_check(text_so_far, tokens_so_far) after every chunk. A truthy
+# return value (which may be awaited) is the stop reason: the stream is closed, which makes Ollama
+# stop generating, and the partial response is returned with eval_count set to the chunks received.
+# timeout bounds the time spent waiting for the server; time spent awaiting stop checks (segment
+# scans) moves the deadline.
+async def stream_chat(client, model, messages, options, keep_alive, stop_check, timeout=None):
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    stream = await asyncio.wait_for(client.chat(model=model, messages=messages, options=options, keep_alive=keep_alive, stream=True),
+                                    remaining())
+    chunks = stream.__aiter__()
+    text = ""
+    tokens = 0
+    final = None
+    stop_reason = None
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), remaining())
+            except StopAsyncIteration:
+                break
+            piece = chunk['message']['content']
+            text += piece
+            if piece:
+                tokens += 1
+            if chunk.get('done'):
+                final = chunk
+                break
+            if stop_check is not None:
+                stop_reason = stop_check(text, tokens)
+                if inspect.isawaitable(stop_reason):
+                    check_start = loop.time()
+                    stop_reason = await stop_reason
+                    if deadline is not None:
+                        deadline += loop.time() - check_start
+                if stop_reason:
+                    break
+    finally:
+        await stream.aclose()
+    response = response_to_dict(final) if final is not None else {"model": model, "done": False, "eval_count": tokens}
+    response["message"] = {"role": "assistant", "content": text}
+    response["stop_reason"] = stop_reason or response.get("done_reason")
+    return response
+
+# Query one message list with a per-attempt timeout and exponential backoff between retries
+# router hands out request slots on a host (see host_pool.make_router). With stream=True the response
+# is streamed and stop_check may end it early; cache_tag names the stop check so cut-short responses
+# are cached apart from complete ones. Requests on a host that was ejected are re-queued without
+# using up a retry.
+async def query_with_retries(router, messages, model, timeout, retries, backoff, options=None,
+                             keep_alive=DEFAULT_KEEP_ALIVE, stream=False, stop_check=None, cache_tag=None):
+    options = with_token_cap(options)
+    if not stream:
+        stop_check = cache_tag = None
+    key = None
+    if response_cache is not None:
+        key = cache_key(model, messages, options, cache_tag)
+        query_start = time.perf_counter()
+        cached = response_cache.get(key)
+        if cached is not None:
+            return {
+                "content": cached['message']['content'],
+                "error": None,
+                "response": cached,
+                "query_time": time.perf_counter() - query_start,
+                "attempts": 0,
+                "cached": True
+            }
+    attempt = 0
+    affinity = affinity_key(messages)
+    while True:
+        sample = {}  # lets an adaptive router learn from the response
+        try:
+            async with router.slot(affinity, sample) as client:
+                query_start = time.perf_counter()
+                if stream:
+                    response = await stream_chat(client, model, messages, options, keep_alive, stop_check, timeout)
+                else:
+                    response = await asyncio.wait_for(client.chat(model=model, messages=messages, options=options, keep_alive=keep_alive),
+                                                      timeout)
+                query_time = time.perf_counter() - query_start
+                sample["response"] = response
+            break
+        except HostUnavailable as e:
+            print(f"Re-queueing request: {e}")
+            continue
+        except Exception as e:
+            error = f"Timed out after {timeout}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+            if attempt >= retries:
+                return {
+                    "content": None,
+                    "error": error,
+                    "response": None,
+                    "query_time": 0,
+                    "attempts": attempt + 1,
+                    "cached": False
+                }
+            await asyncio.sleep(backoff * (2 ** attempt) + random.uniform(0, backoff))
+            attempt += 1
+    if key is not None:
+        try:
+            response_cache.put(key, model, response)
+        except Exception as e:
+            print(f"Response cache write failed: {e}")
+    return {
+        "content": response['message']['content'],
+        "error": None,
+        "response": response,
+        "query_time": query_time,
+        "attempts": attempt + 1,
+        "cached": False
+    }
+
+# router is a started router to use, e.g. the engine's long-lived one; without it the batch gets
+# its own, which is stopped when the batch ends
+async def run_chat_batch_async(message_lists, model=DEFAULT_MODEL, concurrency=DEFAULT_CONCURRENCY,
+                               timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                               options=None, host=None, on_result=None, stream=DEFAULT_STREAM, stop_check=None, cache_tag=None,
+                               keep_alive=DEFAULT_KEEP_ALIVE, router=None):
+    own_router = router is None
+    if own_router:
+        router = make_router(host, concurrency)
+        await router.start()
+
+    async def run_one(idx, messages):
+        # stop_check is either shared by all requests or a list with one (stateful) check per request
+        check = stop_check[idx] if isinstance(stop_check, list) else stop_check
+        result = await query_with_retries(router, messages, model, timeout, retries, backoff, options,
+                                          keep_alive=keep_alive, stream=stream, stop_check=check, cache_tag=cache_tag)
+        if on_result is not None:
+            on_result(idx, result)
+        return result
+
+    try:
+        # gather keeps results in input order regardless of completion order
+        return await asyncio.gather(*[run_one(idx, messages) for idx, messages in enumerate(message_lists)])
+    finally:
+        if own_router:
+            await router.stop()
+
+class Engine:
+    # One event loop and one router per (host, concurrency) for the whole run, so the adaptive
+    # limits, host health and conversation affinity carry over from one batch to the next. close()
+    # stops the routers, printing their reports once; the next batch starts afresh.
+    def __init__(self):
+        self.loop = None
+        self.routers = {}
+
+    async def router(self, host, concurrency):
+        key = (host, concurrency)
+        if key not in self.routers:
+            router = make_router(host, concurrency)
+            await router.start()
+            self.routers[key] = router
+        return self.routers[key]
+
+    # Request slots of the router the batches use, e.g. to size lockstep conversation batches
+    def capacity(self, host=None, concurrency=DEFAULT_CONCURRENCY):
+        return self.run(self.router(host, concurrency)).capacity()
+
+    def run(self, coroutine):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            atexit.register(self.close)
+        return self.loop.run_until_complete(coroutine)
+
+    async def run_batch(self, message_lists, host=None, concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        router = await self.router(host, concurrency)
+        return await run_chat_batch_async(message_lists, host=host, concurrency=concurrency, router=router, **kwargs)
+
+    def close(self):
+        if self.loop is None:
+            return
+        loop = self.loop
+        try:
+            for router in self.routers.values():
+                loop.run_until_complete(router.stop())
+            # Requests left over by an interrupted batch
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            self.routers = {}
+            self.loop = None
+            atexit.unregister(self.close)
+            loop.close()
+
+engine = Engine()
+
+# Stop the run's routers (printing their reports); runners call it when their requests are done
+def close_engine():
+    engine.close()
+
+# Run many chat requests with a bounded number in flight; results come back in input order
+def run_chat_batch(message_lists, **kwargs):
+    if not message_lists:
+        return []
+    return engine.run(engine.run_batch(message_lists, **kwargs))
+
+def run_prompt_batch(prompts, **kwargs):
+    return run_chat_batch([user_messages(prompt) for prompt in prompts], **kwargs)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = os.environ.get("LLM_TESTER_CACHE_PATH", "response_cache.sqlite")
+DEFAULT_CACHE_MAX_MB = float(os.environ.get("LLM_TESTER_CACHE_MAX_MB", "512"))
+DEFAULT_CACHE_MAX_AGE_DAYS = float(os.environ.get("LLM_TESTER_CACHE_MAX_AGE_DAYS", "30"))
+
+# Content-addressed key: the same model, message list and generation options give the same key.
+# tag separates responses that were produced differently, e.g. streams cut short by a stop check.
+def cache_key(model, messages, options=None, tag=None):
+    payload = json.dumps({"model": model, "messages": list(messages), "options": options or {}, "tag": tag}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Plain dict copy of an Ollama ChatResponse so it can be stored as JSON
+def response_to_dict(response):
+    if hasattr(response, "model_dump"):
+        return response.model_dump(mode="json")
+    return dict(response)
+
+class ResponseCache:
+    # On-disk cache of successful chat responses; refresh=True skips lookups but still stores new responses
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_mb=DEFAULT_CACHE_MAX_MB, max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS, refresh=False):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self.conn.commit()
+
+    def get(self, key):
+        if self.refresh:
+            self.misses += 1
+            return None
+        row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, model, response):
+        data = json.dumps(response_to_dict(response), ensure_ascii=False)
+        now = time.time()
+        self.conn.execute("INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                          (key, model, data, len(data), now, now))
+        self.conn.commit()
+
+    # Drop expired entries, then least recently used ones until the cache fits in max_mb
+    def evict(self):
+        removed = self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)).rowcount
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        self.conn.commit()
+        return removed
+
+    def report(self):
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0.0
+        mode = " (refresh mode, lookups skipped)" if self.refresh else ""
+        return f"Response cache: {self.hits} hits, {self.misses} misses, hit ratio {ratio:.1%}{mode}"
+
+    def close(self):
+        removed = self.evict()
+        if removed:
+            print(f"Response cache: evicted {removed} entries")
+        self.conn.close()
+
+# Shared command-line switches for the runners
+def add_cache_arguments(parser):
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached responses but store the new ones")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite file for the response cache")
+
+def cache_from_args(args):
+    if args.no_cache:
+        return None
+    return ResponseCache(args.cache_path, refresh=args.refresh)
@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+import textwrap
+
+# Appends results to a JSONL or CSV file as they complete and keeps a manifest of finished
+# prompt ids next to it (<path>.manifest, one id per line) so an interrupted run can resume
+class ResultSink:
+    def __init__(self, path, fieldnames=None, resume=False):
+        self.path = path
+        self.manifest_path = path + ".manifest"
+        self.is_csv = path.endswith(".csv")
+        self.fieldnames = fieldnames
+        self.done = set()
+        self.records = 0  # rows in the output, including those from resumed runs
+        mode = "a" if resume else "w"
+        if resume:
+            self.done = load_manifest(self.manifest_path)
+            self.records = count_records(path)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0 or not resume
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, mode, newline="" if self.is_csv else None, encoding="utf-8")
+        self.manifest = open(self.manifest_path, mode, encoding="utf-8")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            if new_file:
+                self.writer.writeheader()
+                self.file.flush()
+
+    def is_done(self, prompt_id):
+        return str(prompt_id) in self.done
+
+    def write(self, record):
+        if self.is_csv:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.records += 1
+
+    # Called after a prompt's rows are written; a crash in between re-runs the prompt on resume
+    def mark_done(self, prompt_id):
+        self.done.add(str(prompt_id))
+        self.manifest.write(f"{prompt_id}\n")
+        self.manifest.flush()
+
+    def close(self):
+        self.file.close()
+        self.manifest.close()
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def count_records(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", newline="" if path.endswith(".csv") else None, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            return max(0, sum(1 for _ in csv.reader(f)) - 1)
+        return sum(1 for line in f if line.strip())
+
+# Convert a JSONL results file into the JSON array the runners have always produced,
+# one record at a time so memory stays flat
+def export_json(jsonl_path, json_path):
+    with open(jsonl_path, "r", encoding="utf-8") as src, open(json_path, "w", encoding="utf-8") as dst:
+        dst.write("[")
+        first = True
+        for line in src:
+            if not line.strip():
+                continue
+            dst.write("\n" if first else ",\n")
+            dst.write(textwrap.indent(json.dumps(json.loads(line), indent=2), "  "))
+            first = False
+        dst.write("\n]\n" if not first else "]\n")
+
+def add_sink_arguments(parser):
+    parser.add_argument("--resume", action="store_true", help="Skip prompts already recorded in the run manifest and append to the existing results")
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# Every outcome of every run (pass, fail, blocked, error) with typed scanner scores, next to the
+# JSON/CSV result files; "" disables it. Also set by --results-db.
+DEFAULT_RESULTS_DB = os.environ.get("LLM_TESTER_RESULTS_DB", "results.sqlite")
+INSERT_BATCH = 500  # rows buffered before they are written in one transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    runner TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    model TEXT,
+    shard TEXT,
+    scanner_config TEXT,
+    settings TEXT,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    prompt_id TEXT NOT NULL,
+    type TEXT,
+    category TEXT,
+    prompt TEXT,
+    response TEXT,
+    outcome TEXT NOT NULL,
+    blocked_by TEXT,
+    error TEXT,
+    input_scan_time REAL,
+    query_time REAL,
+    prompt_eval_count INTEGER,
+    eval_count INTEGER,
+    stop_reason TEXT,
+    duplicate_of TEXT,
+    PRIMARY KEY (run_id, prompt_id)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL,
+    prompt_id TEXT NOT NULL,
+    scanner TEXT NOT NULL,
+    score REAL,
+    PRIMARY KEY (run_id, prompt_id, scanner)
+);
+CREATE INDEX IF NOT EXISTS results_outcome ON results (run_id, outcome);
+CREATE INDEX IF NOT EXISTS results_category ON results (run_id, category);
+CREATE INDEX IF NOT EXISTS results_type ON results (run_id, type);
+CREATE INDEX IF NOT EXISTS scores_scanner ON scores (scanner, score);
+"""
+
+RESULT_COLUMNS = ["prompt_id", "type", "category", "prompt", "response", "outcome", "blocked_by", "error", "input_scan_time",
+                  "query_time", "prompt_eval_count", "eval_count", "stop_reason", "duplicate_of"]
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)  # shards running side by side wait for each other's commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+# The settings a run was started with: LLM_TESTER_* variables and the command line
+def run_settings():
+    settings = {key: value for key, value in os.environ.items() if key.startswith("LLM_TESTER_")}
+    settings["argv"] = sys.argv
+    return settings
+
+class ResultsDB:
+    # One run of one runner; rows are buffered and inserted in batches
+    def __init__(self, path):
+        self.path = path
+        self.conn = connect(path)
+        self.run_id = None
+        self.pending_results = []
+        self.pending_scores = []
+
+    # With resume the latest run of the same runner, dataset and shard is continued, so its
+    # earlier results stay part of the run
+    def start_run(self, runner, dataset, model, shard=None, scanner_config=None, resume=False):
+        shard = f"{shard[0]}/{shard[1]}" if shard is not None else None
+        if resume:
+            row = self.conn.execute("SELECT run_id FROM runs WHERE runner = ? AND dataset = ? AND shard IS ? ORDER BY run_id DESC LIMIT 1",
+                                    (runner, dataset, shard)).fetchone()
+            if row is not None:
+                self.run_id = row[0]
+                self.conn.execute("UPDATE runs SET finished = NULL WHERE run_id = ?", (self.run_id,))
+                self.conn.commit()
+                return self.run_id
+        cursor = self.conn.execute("INSERT INTO runs (runner, dataset, model, shard, scanner_config, settings, started) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (runner, dataset, model, shard, json.dumps(scanner_config) if scanner_config else None,
+                                    json.dumps(run_settings()), time.time()))
+        self.conn.commit()
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    # record holds RESULT_COLUMNS (missing ones are NULL); scores maps "<stage>.<scanner>" to a risk score
+    def add(self, record, scores=None):
+        self.pending_results.append((self.run_id,) + tuple(record.get(column) for column in RESULT_COLUMNS))
+        for scanner, score in (scores or {}).items():
+            self.pending_scores.append((self.run_id, record["prompt_id"], scanner, score))
+        if len(self.pending_results) >= INSERT_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_results and not self.pending_scores:
+            return
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO results (run_id, {', '.join(RESULT_COLUMNS)}) VALUES ({', '.join('?' * (len(RESULT_COLUMNS) + 1))})",
+                                  self.pending_results)
+            self.conn.executemany("INSERT OR REPLACE INTO scores (run_id, prompt_id, scanner, score) VALUES (?, ?, ?, ?)", self.pending_scores)
+        self.pending_results = []
+        self.pending_scores = []
+
+    def finish_run(self):
+        self.flush()
+        if self.run_id is not None:
+            with self.conn:
+                self.conn.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), self.run_id))
+            self.run_id = None
+
+    def close(self):
+        self.finish_run()
+        self.conn.close()
+
+# Stage-prefixed scores of a guarded result, e.g. {"input.Toxicity": 0.1, "output.Toxicity": 0.8}
+def stage_scores(input_scores, output_scores):
+    scores = {f"input.{name}": score for name, score in (input_scores or {}).items()}
+    scores.update({f"output.{name}": score for name, score in (output_scores or {}).items()})
+    return scores
+
+# Outcome of a guarded result from its response text and scores
+def guarded_outcome_fields(response, output_scores):
+    if response == "Blocked":
+        return {"outcome": "blocked", "blocked_by": "output" if output_scores else "input"}
+    if response is not None and response.startswith("Error: "):
+        return {"outcome": "error", "error": response[len("Error: "):]}
+    return {"outcome": "pass"}
+
+def add_results_db_arguments(parser):
+    parser.add_argument("--results-db", default=DEFAULT_RESULTS_DB, metavar="PATH",
+                        help="SQLite database that receives every outcome of the run ('' to disable)")
+
+def results_db_from_args(args):
+    if not args.results_db:
+        return None
+    return ResultsDB(args.results_db)
+
+# Query CLI
+
+GROUPS = {"category": "r.category", "type": "r.type", "model": "runs.model", "run": "r.run_id", "runner": "runs.runner"}
+
+def print_table(headers, rows):
+    rows = [["" if value is None else (f"{value:.3f}" if isinstance(value, float) else str(value)) for value in row] for row in rows]
+    widths = [max([len(str(header))] + [len(row[i]) for row in rows]) for i, header in enumerate(headers)]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+def run_filter(args):
+    clauses, params = [], []
+    if args.run:
+        clauses.append(f"r.run_id IN ({', '.join('?' * len(args.run))})")
+        params.extend(args.run)
+    if args.runner:
+        clauses.append("runs.runner = ?")
+        params.append(args.runner)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def command_runs(conn, args):
+    rows = conn.execute("""SELECT runs.run_id, runner, dataset, model, shard, datetime(started, 'unixepoch', 'localtime'),
+                                  CASE WHEN finished IS NULL THEN 'no' ELSE 'yes' END, COUNT(r.prompt_id)
+                           FROM runs LEFT JOIN results r ON r.run_id = runs.run_id GROUP BY runs.run_id ORDER BY runs.run_id""").fetchall()
+    print_table(["run", "runner", "dataset", "model", "shard", "started", "finished", "results"], rows)
+
+def command_summary(conn, args):
+    where, params = run_filter(args)
+    group = GROUPS[args.by]
+    rows = conn.execute(f"""SELECT {group}, COUNT(*), SUM(outcome = 'pass'), SUM(outcome = 'fail'), SUM(outcome = 'blocked'),
+                                   SUM(outcome = 'error'), AVG(query_time), AVG(input_scan_time)
+                            FROM results r JOIN runs ON runs.run_id = r.run_id{where}
+                            GROUP BY {group} ORDER BY COUNT(*) DESC LIMIT ?""", params + [args.limit]).fetchall()
+    print_table([args.by, "total", "pass", "fail", "blocked", "error", "avg query s", "avg scan s"], rows)
+
+def command_scores(conn, args):
+    where, params = run_filter(args)
+    group = GROUPS[args.by]
+    rows = conn.execute(f"""SELECT {group}, s.scanner, COUNT(*), AVG(s.score), MAX(s.score), SUM(s.score > ?)
+                            FROM scores s JOIN results r ON r.run_id = s.run_id AND r.prompt_id = s.prompt_id
+                            JOIN runs ON runs.run_id = r.run_id{where}
+                            GROUP BY {group}, s.scanner ORDER BY {group}, s.scanner LIMIT ?""", [args.threshold] + params + [args.limit]).fetchall()
+    print_table([args.by, "scanner", "scored", "mean", "max", f"> {args.threshold:g}"], rows)
+
+# Prompts whose outcome differs between two runs, and the counts of each outcome change
+def command_diff(conn, args):
+    rows = conn.execute("""SELECT a.prompt_id, a.category, a.outcome, b.outcome
+                           FROM results a JOIN results b ON b.prompt_id = a.prompt_id AND b.run_id = ?
+                           WHERE a.run_id = ? AND a.outcome != b.outcome ORDER BY a.prompt_id""", (args.run_b, args.run_a)).fetchall()
+    only = {}
+    for name, this, other in [("a", args.run_a, args.run_b), ("b", args.run_b, args.run_a)]:
+        only[name] = conn.execute("""SELECT COUNT(*) FROM results x WHERE x.run_id = ?
+                                     AND NOT EXISTS (SELECT 1 FROM results y WHERE y.run_id = ? AND y.prompt_id = x.prompt_id)""",
+                                  (this, other)).fetchone()[0]
+    transitions = {}
+    for _, _, before, after in rows:
+        transitions[(before, after)] = transitions.get((before, after), 0) + 1
+    print(f"Run {args.run_a} -> run {args.run_b}: {len(rows)} changed outcomes, {only['a']} prompts only in run {args.run_a}, "
+          f"{only['b']} only in run {args.run_b}")
+    print_table(["from", "to", "prompts"], [(before, after, count) for (before, after), count in sorted(transitions.items())])
+    if rows and args.limit:
+        print()
+        print_table(["prompt", "category", f"run {args.run_a}", f"run {args.run_b}"], rows[:args.limit])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results database.")
+    parser.add_argument("--db", default=DEFAULT_RESULTS_DB or "results.sqlite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("runs", help="List runs")
+    for name, help_text in [("summary", "Outcome counts and mean timings"), ("scores", "Scanner score statistics")]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--by", choices=sorted(GROUPS), default="category")
+        command.add_argument("--run", type=int, action="append", help="Only these runs (repeatable)")
+        command.add_argument("--runner", default=None, help="Only runs of this runner")
+        command.add_argument("--limit", type=int, default=50)
+        if name == "scores":
+            command.add_argument("--threshold", type=float, default=0.5, help="Count scores above this")
+    diff = commands.add_parser("diff", help="Outcome changes between two runs")
+    diff.add_argument("run_a", type=int)
+    diff.add_argument("run_b", type=int)
+    diff.add_argument("--limit", type=int, default=50, help="Changed prompts to list")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"No results database at {args.db}")
+        exit(1)
+    conn = connect(args.db)
+    {"runs": command_runs, "summary": command_summary, "scores": command_scores, "diff": command_diff}[args.command](conn, args)
+    conn.close()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+
+# Headless entry point: runs the HarmfulQA, ToxicChat and guarded runners unattended from a job spec
+# (YAML or JSON) or command-line flags, one job after another. Each job runs in its own process,
+# since model, concurrency and scanner settings are read from LLM_TESTER_* variables at import and
+# the scanner models are released when a job ends.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNNERS = {
+    "harmfulqa": ("unprotected_test_llm.py", "test_results.json"),
+    "toxicchat": ("unprotected_test_toxicchat.py", "toxicchat_test_results.json"),
+    "guarded": ("llmguard_test_llm.py", "guarded_results.csv")
+}
+
+# Job keys passed to the runner as options
+ARG_KEYS = {"range": "--range", "category": "--category", "shard": "--shard", "dedup": "--dedup", "output": "--output",
+            "results_db": "--results-db", "metrics": "--metrics", "metrics_export": "--metrics-export", "cache_path": "--cache-path"}
+FLAG_KEYS = {"resume": "--resume", "refresh": "--refresh"}
+SAMPLE_KEYS = {"margin": "--margin", "confidence": "--confidence", "strata": "--strata", "seed": "--seed"}
+# Job keys passed as environment variables
+ENV_KEYS = {"model": "LLM_TESTER_MODEL", "concurrency": "LLM_TESTER_CONCURRENCY", "hosts": "LLM_TESTER_HOSTS",
+            "timeout": "LLM_TESTER_TIMEOUT", "retries": "LLM_TESTER_RETRIES", "stream": "LLM_TESTER_STREAM",
+            "max_tokens": "LLM_TESTER_MAX_TOKENS", "keep_alive": "LLM_TESTER_KEEP_ALIVE", "multi_turn": "LLM_TESTER_MULTI_TURN",
+            "chunk_size": "LLM_TESTER_CHUNK_SIZE"}
+SCANNER_KEYS = {"threshold": "LLM_TESTER_SCANNER_THRESHOLD", "banned_topics": "LLM_TESTER_BANNED_TOPICS",
+                "backend": "LLM_TESTER_SCANNER_BACKEND", "workers": "LLM_TESTER_SCAN_WORKERS", "batch": "LLM_TESTER_SCAN_BATCH",
+                "mode": "LLM_TESTER_SCAN_MODE", "threads": "LLM_TESTER_SCAN_THREADS"}
+JOB_KEYS = set(ARG_KEYS) | set(FLAG_KEYS) | set(ENV_KEYS) | {"name", "runner", "models", "cache", "sample", "scanners", "env", "workdir"}
+
+class JobError(Exception):
+    pass
+
+def load_spec(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise JobError("YAML job files need PyYAML (pip install pyyaml); JSON job files work without it")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+# A spec is one job, a list of jobs, or {"defaults": {...}, "jobs": [...]}
+def spec_jobs(spec):
+    if isinstance(spec, list):
+        return {}, spec
+    if isinstance(spec, dict) and "jobs" in spec:
+        return spec.get("defaults") or {}, spec["jobs"]
+    if isinstance(spec, dict):
+        return {}, [spec]
+    raise JobError("A job spec must be a job, a list of jobs or a mapping with 'jobs'")
+
+def env_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(item) for item in value)
+    return str(value)
+
+def model_slug(model):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", model)
+
+# One job per model. Output paths may use {name} and {model}; without either, jobs of a
+# several-model entry get the model added to their output file names.
+def expand(entry, defaults, overrides, number):
+    job = dict(defaults)
+    job.update(entry)
+    job.update(overrides)
+    unknown = sorted(set(job) - JOB_KEYS)
+    if unknown:
+        raise JobError(f"job {number}: unknown keys {', '.join(unknown)}")
+    runner = job.get("runner")
+    if runner not in RUNNERS:
+        raise JobError(f"job {number}: runner must be one of {', '.join(RUNNERS)}, not {runner!r}")
+    if job.get("category") and runner != "guarded":
+        raise JobError(f"job {number}: category is only supported by the guarded runner")
+    models = job.pop("models", None) or [job.get("model")]
+    if isinstance(models, str):
+        models = [models]
+    jobs = []
+    for model in models:
+        entry = dict(job, model=model)
+        if model is None:
+            entry.pop("model")
+        entry["name"] = job.get("name") or f"{runner}-{model_slug(model or 'default')}"
+        if len(models) > 1 and job.get("name"):
+            entry["name"] = f"{job['name']}-{model_slug(model)}"
+        for key in ("output", "metrics", "metrics_export"):
+            path = entry.get(key) or (RUNNERS[runner][1] if key == "output" and len(models) > 1 else None)
+            if not path:
+                continue
+            if len(models) > 1 and "{model}" not in path and "{name}" not in path:
+                base, ext = os.path.splitext(path)
+                path = base + ".{model}" + ext
+            entry[key] = path.format(name=entry["name"], model=model_slug(model or "default"))
+        jobs.append(entry)
+    return jobs
+
+# Command line and environment of a job; the range defaults to everything so nothing is asked
+def command(job):
+    script, _ = RUNNERS[job["runner"]]
+    argv = [sys.executable, os.path.join(REPO_DIR, script), "--range", str(job.get("range", "0"))]
+    for key, option in ARG_KEYS.items():
+        if key != "range" and job.get(key) is not None:
+            argv += [option, str(job[key])]
+    argv += [option for key, option in FLAG_KEYS.items() if job.get(key)]
+    if job.get("cache") is False:
+        argv.append("--no-cache")
+    sample = job.get("sample")
+    if sample:
+        argv.append("--sample")
+        for key, value in (sample.items() if isinstance(sample, dict) else []):
+            if key not in SAMPLE_KEYS:
+                raise JobError(f"{job['name']}: unknown sample key {key}")
+            argv += [SAMPLE_KEYS[key], env_value(value)]
+    env = {"PYTHONUNBUFFERED": "1"}
+    env.update({variable: env_value(job[key]) for key, variable in ENV_KEYS.items() if job.get(key) is not None})
+    for key, value in (job.get("scanners") or {}).items():
+        if key not in SCANNER_KEYS:
+            raise JobError(f"{job['name']}: unknown scanners key {key}")
+        env[SCANNER_KEYS[key]] = env_value(value)
+    env.update({key: env_value(value) for key, value in (job.get("env") or {}).items()})
+    return argv, env
+
+def run(job, argv, env, log_dir):
+    log_path = os.path.join(log_dir, job["name"] + ".log") if log_dir else None
+    start = time.perf_counter()
+    if log_path:
+        os.makedirs(log_dir, exist_ok=True)
+        with open(log_path, "w", encoding="utf-8") as log:
+            code = subprocess.call(argv, cwd=job.get("workdir"), env=dict(os.environ, **env), stdin=subprocess.DEVNULL,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    else:
+        code = subprocess.call(argv, cwd=job.get("workdir"), env=dict(os.environ, **env), stdin=subprocess.DEVNULL)
+    return code, time.perf_counter() - start, log_path
+
+def override_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+# Job keys given on the command line; they override the spec for every job
+def cli_overrides(args):
+    overrides = {}
+    for key in ("runner", "range", "category", "shard", "output", "concurrency", "results_db", "dedup"):
+        if getattr(args, key) is not None:
+            overrides[key] = getattr(args, key)
+    if args.model:
+        overrides["models"] = args.model
+    if args.resume:
+        overrides["resume"] = True
+    if args.no_cache:
+        overrides["cache"] = False
+    if args.sample:
+        overrides["sample"] = {"margin": args.margin} if args.margin is not None else True
+    scanners = {key: value for key, value in [("threshold", args.scanner_threshold), ("backend", args.scanner_backend),
+                                              ("workers", args.scan_workers)] if value is not None}
+    if scanners:
+        overrides["scanners"] = scanners
+    for item in args.set:
+        key, _, value = item.partition("=")
+        overrides[key.strip()] = override_value(value)
+    return overrides
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run test jobs unattended from a YAML/JSON job spec or command-line flags.")
+    parser.add_argument("spec", nargs="?", help="Job spec file (.yaml, .yml or .json)")
+    parser.add_argument("--only", action="append", default=[], metavar="NAME", help="Run only these jobs (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Print each job's command and settings without running it")
+    parser.add_argument("--stop-on-error", action="store_true", help="Stop the queue at the first failed job")
+    parser.add_argument("--log-dir", default=None, help="Write each job's output to <dir>/<name>.log instead of the terminal")
+    parser.add_argument("--report", default=None, metavar="PATH", help="Write the status of every job to this JSON file")
+    job_options = parser.add_argument_group("job options (override the spec for every job)")
+    job_options.add_argument("--runner", choices=sorted(RUNNERS), default=None)
+    job_options.add_argument("--model", action="append", default=[], help="Model to test (repeatable: one job per model)")
+    job_options.add_argument("--range", default=None, metavar="SPEC", help="0 for all, N for the first N, start-end for a range")
+    job_options.add_argument("--category", default=None)
+    job_options.add_argument("--shard", default=None, metavar="i/N")
+    job_options.add_argument("--output", default=None, help="Result file; may contain {name} and {model}")
+    job_options.add_argument("--concurrency", type=int, default=None)
+    job_options.add_argument("--results-db", default=None, metavar="PATH")
+    job_options.add_argument("--dedup", default=None)
+    job_options.add_argument("--resume", action="store_true")
+    job_options.add_argument("--no-cache", action="store_true")
+    job_options.add_argument("--sample", action="store_true")
+    job_options.add_argument("--margin", type=float, default=None)
+    job_options.add_argument("--scanner-threshold", type=float, default=None)
+    job_options.add_argument("--scanner-backend", default=None)
+    job_options.add_argument("--scan-workers", type=int, default=None)
+    job_options.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Any other job key, e.g. --set stream=true")
+    args = parser.parse_args()
+
+    try:
+        defaults, entries = spec_jobs(load_spec(args.spec)) if args.spec else ({}, [{}])
+        overrides = cli_overrides(args)
+        jobs = [job for number, entry in enumerate(entries, 1) for job in expand(entry, defaults, overrides, number)]
+        if args.only:
+            jobs = [job for job in jobs if job["name"] in args.only]
+        commands = [command(job) for job in jobs]
+    except (JobError, OSError, ValueError) as e:
+        print(f"Invalid job spec: {e}")
+        exit(1)
+    names = [job["name"] for job in jobs]
+    if len(set(names)) < len(names):
+        print(f"Warning: several jobs share a name ({', '.join(sorted({name for name in names if names.count(name) > 1}))}); their logs overwrite each other")
+
+    statuses = []
+    for n, (job, (argv, env)) in enumerate(zip(jobs, commands), 1):
+        settings = " ".join(f"{key}={value}" for key, value in env.items() if key != "PYTHONUNBUFFERED")
+        print(f"[{n}/{len(jobs)}] {job['name']}: {settings} {shlex.join(argv[1:])}".replace(REPO_DIR + os.sep, ""))
+        if args.dry_run:
+            continue
+        code, seconds, log_path = run(job, argv, env, args.log_dir)
+        statuses.append({"name": job["name"], "runner": job["runner"], "model": job.get("model"), "command": argv, "env": env,
+                         "exit_code": code, "seconds": round(seconds, 1), "log": log_path})
+        print(f"[{n}/{len(jobs)}] {job['name']} {'finished' if code == 0 else f'failed with exit code {code}'} in {seconds:.0f}s"
+              + (f", log in {log_path}" if log_path else ""))
+        if code != 0 and args.stop_on_error:
+            print("Stopping: --stop-on-error")
+            break
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(statuses, f, indent=2)
+    failed = [status["name"] for status in statuses if status["exit_code"] != 0]
+    if statuses:
+        print(f"\n{len(statuses) - len(failed)} of {len(jobs)} jobs succeeded" + (f"; failed: {', '.join(failed)}" if failed else ""))
+    exit(1 if failed else 0)
@@ -0,0 +1,164 @@
+import argparse
+import math
+import os
+import random
+from statistics import NormalDist
+
+# Stratified sampling for estimating a rate (refusals, blocks) without running the whole dataset.
+# Prompts run in a random order that keeps every stratum at its share of the population, the rate
+# is estimated per stratum and overall as results come in, and the run stops once the overall
+# confidence interval is within the target margin of error.
+DEFAULT_SAMPLE_MARGIN = float(os.environ.get("LLM_TESTER_SAMPLE_MARGIN", "0.03"))  # half-width of the interval
+DEFAULT_SAMPLE_CONFIDENCE = float(os.environ.get("LLM_TESTER_SAMPLE_CONFIDENCE", "0.95"))
+DEFAULT_SAMPLE_ROUND = int(os.environ.get("LLM_TESTER_SAMPLE_ROUND", "64"))  # prompts between stop checks
+MIN_PER_STRATUM = int(os.environ.get("LLM_TESTER_SAMPLE_MIN_PER_STRATUM", "5"))
+
+# Fields a dataset row can be stratified by
+STRATUM_FIELDS = {
+    "topic": lambda row: row.get("topic") or "-",
+    "subtopic": lambda row: f"{row.get('topic')}/{row.get('subtopic')}",
+    "type": lambda row: row.get("type") or "question",
+    "toxicity": lambda row: "toxic" if row.get("toxicity") == "1" else "non-toxic",
+    "jailbreaking": lambda row: "jailbreaking" if row.get("jailbreaking") == "1" else "no-jailbreaking",
+}
+
+def parse_strata(value):
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in STRATUM_FIELDS]
+    if not fields or unknown:
+        raise argparse.ArgumentTypeError(f"invalid strata '{value}', expected a comma-separated list of {', '.join(STRATUM_FIELDS)}")
+    return fields
+
+def wilson_interval(hits, n, z):
+    if n == 0:
+        return 0.0, 1.0
+    p = hits / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+class StratifiedSampler:
+    def __init__(self, fields, metric, margin=DEFAULT_SAMPLE_MARGIN, confidence=DEFAULT_SAMPLE_CONFIDENCE,
+                 round_size=DEFAULT_SAMPLE_ROUND, min_per_stratum=MIN_PER_STRATUM, seed=None):
+        self.fields = fields
+        self.metric = metric  # what a hit is, e.g. "refusal rate"
+        self.margin = margin
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.round_size = max(1, round_size)
+        self.min_per_stratum = min_per_stratum
+        self.random = random.Random(seed)
+        self.population = {}  # stratum -> prompts in the population
+        self.strata_of = {}  # prompt id -> stratum
+        self.counts = {}
+        self.hits = {}
+        self.sampled = 0
+        self.stopped = False
+
+    def stratum(self, row):
+        return " | ".join(STRATUM_FIELDS[field](row) for field in self.fields)
+
+    # Register a prompt of the population; call for every prompt the estimate is about
+    def assign(self, prompt_id, row):
+        stratum = self.stratum(row)
+        self.strata_of[str(prompt_id)] = stratum
+        self.population[stratum] = self.population.get(stratum, 0) + 1
+
+    # Random order within each stratum, interleaved so that every prefix holds each stratum in
+    # proportion to its size
+    def order(self, items, id_of):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.strata_of[str(id_of(item))], []).append(item)
+        keyed = []
+        for members in groups.values():
+            self.random.shuffle(members)
+            offset = self.random.random()
+            keyed.extend(((k + offset) / len(members), item) for k, item in enumerate(members))
+        keyed.sort(key=lambda pair: pair[0])
+        return [item for _, item in keyed]
+
+    # One verdict; errors should not be added
+    def add(self, prompt_id, hit):
+        stratum = self.strata_of.get(str(prompt_id))
+        if stratum is None:
+            return
+        self.counts[stratum] = self.counts.get(stratum, 0) + 1
+        self.hits[stratum] = self.hits.get(stratum, 0) + bool(hit)
+        self.sampled += 1
+        if self.sampled % self.round_size == 0:
+            print(self.progress())
+
+    # Stratified estimate and the half-width of its interval. Strata variances use the
+    # Agresti-Coull adjusted rate, so a stratum with no hits yet does not look certain, and the
+    # finite population correction, so an exhausted stratum adds none; an unsampled stratum counts
+    # with the worst-case variance.
+    def estimate(self):
+        total = sum(self.population.values())
+        if total == 0:
+            return 0.0, 0.0
+        sampled_weight = 0.0
+        weighted = 0.0
+        variance = 0.0
+        for stratum, size in self.population.items():
+            weight = size / total
+            n = self.counts.get(stratum, 0)
+            if n == 0:
+                variance += weight * weight * 0.25
+                continue
+            hits = self.hits.get(stratum, 0)
+            sampled_weight += weight
+            weighted += weight * hits / n
+            adjusted = (hits + self.z * self.z / 2) / (n + self.z * self.z)
+            variance += weight * weight * adjusted * (1 - adjusted) / n * (1 - n / size)
+        rate = weighted / sampled_weight if sampled_weight else 0.0
+        return rate, self.z * math.sqrt(variance)
+
+    def done(self):
+        if any(self.counts.get(stratum, 0) < min(self.min_per_stratum, size) for stratum, size in self.population.items()):
+            return False
+        return self.estimate()[1] <= self.margin
+
+    # Checked before more prompts are started; announces the stop once
+    def should_stop(self):
+        if not self.stopped and self.done():
+            self.stopped = True
+            rate, margin = self.estimate()
+            print(f"Target margin reached after {self.sampled} of {sum(self.population.values())} prompts: "
+                  f"{self.metric} {rate:.1%} ± {margin:.1%}; the remaining prompts are skipped")
+        return self.stopped
+
+    def progress(self):
+        rate, margin = self.estimate()
+        return (f"Sampled {self.sampled} of {sum(self.population.values())}: {self.metric} {rate:.1%} ± {margin:.1%} "
+                f"(target ±{self.margin:.1%} at {self.confidence:.0%} confidence)")
+
+    def report(self):
+        print(f"\n{self.metric.capitalize()} by stratum ({', '.join(self.fields)}), {self.confidence:.0%} Wilson intervals:")
+        rows = []
+        for stratum in sorted(self.population):
+            n = self.counts.get(stratum, 0)
+            hits = self.hits.get(stratum, 0)
+            low, high = wilson_interval(hits, n, self.z)
+            rows.append([stratum, f"{n}/{self.population[stratum]}", str(hits), f"{hits / n:.1%}" if n else "-", f"{low:.1%} - {high:.1%}"])
+        headers = ["stratum", "sampled", "hits", "rate", "interval"]
+        widths = [max([len(header)] + [len(row[c]) for row in rows]) for c, header in enumerate(headers)]
+        print("  ".join(header.ljust(width) for header, width in zip(headers, widths)))
+        for row in rows:
+            print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+        print(self.progress())
+
+def add_sampling_arguments(parser, default_strata):
+    parser.add_argument("--sample", action="store_true",
+                        help="Run prompts in random stratified order and stop once the estimated rate is within --margin")
+    parser.add_argument("--strata", type=parse_strata, default=default_strata,
+                        help=f"Fields to stratify by, comma-separated: {', '.join(STRATUM_FIELDS)} (default {default_strata})")
+    parser.add_argument("--margin", type=float, default=DEFAULT_SAMPLE_MARGIN, help="Target margin of error, e.g. 0.03 for ±3%%")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_SAMPLE_CONFIDENCE, help="Confidence level of the interval")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the sampling order")
+
+def sampler_from_args(args, metric):
+    if not args.sample:
+        return None
+    return StratifiedSampler(args.strata, metric, margin=args.margin, confidence=args.confidence, seed=args.seed)
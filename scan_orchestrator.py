@@ -0,0 +1,159 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from instrumentation import record_skipped_scan
+from scanner_registry import llm_guard
+
+# How the input scanners are run on a prompt:
+#   full      - every scanner in the configured order, all scores recorded (for research runs)
+#   fail_fast - cheapest scanner per expected block first, stopping at the first blocking verdict;
+#               scanners that were skipped have no score for the prompt
+DEFAULT_SCAN_MODE = os.environ.get("LLM_TESTER_SCAN_MODE", "full")
+SCAN_MODES = ("full", "fail_fast")
+# Above 1, up to this many scanners of a prompt run concurrently in threads (the transformers
+# backends release the GIL during inference)
+DEFAULT_SCAN_THREADS = int(os.environ.get("LLM_TESTER_SCAN_THREADS", "0"))
+# Prompts scanned in full at the start, to measure each scanner's cost and block rate before reordering
+DEFAULT_SCAN_WARMUP = int(os.environ.get("LLM_TESTER_SCAN_WARMUP", "20"))
+
+class ScanOrchestrator:
+    # Scans with the scanners of one stage and learns their cost and block rate as it goes. Scanners
+    # get the original prompt rather than the previous scanner's output: the input scanners in use
+    # only score text, they do not rewrite it.
+    def __init__(self, stage, mode=DEFAULT_SCAN_MODE, threads=DEFAULT_SCAN_THREADS, warmup=DEFAULT_SCAN_WARMUP):
+        if mode not in SCAN_MODES:
+            print(f"Unknown scan mode '{mode}', using full")
+            mode = "full"
+        self.stage = stage
+        self.mode = mode
+        self.threads = threads
+        self.warmup = warmup
+        self.scans = 0
+        self.costs = {}  # scanner name -> [calls, seconds]
+        self.blocks = {}
+        self.executor = None
+
+    def mean_cost(self, name):
+        calls, seconds = self.costs.get(name, (0, 0.0))
+        return seconds / calls if calls else 0.0
+
+    # Expected cost per blocking verdict; the smallest goes first. Unmeasured scanners go first so
+    # they get measured; the block rate is smoothed so a scanner that has not blocked yet still counts.
+    def priority(self, scanner):
+        name = type(scanner).__name__
+        calls = self.costs.get(name, (0, 0.0))[0]
+        if calls == 0:
+            return 0.0
+        return self.mean_cost(name) / ((self.blocks.get(name, 0) + 1) / (calls + 2))
+
+    def fail_fast(self):
+        return self.mode == "fail_fast" and self.scans >= self.warmup
+
+    def order(self, scanners):
+        return sorted(scanners, key=self.priority) if self.fail_fast() else list(scanners)
+
+    # The scanners worth running in a batched pre-scan: with fail-fast only the first in order
+    # sees every prompt, the others are scanned one prompt at a time when they are reached
+    def prescan_scanners(self, scanners):
+        return self.order(scanners)[:1] if self.fail_fast() else scanners
+
+    def run_one(self, scanner, prompt):
+        start = time.perf_counter()
+        _, is_valid, risk_score = scanner.scan(prompt)
+        return is_valid, risk_score, time.perf_counter() - start
+
+    def observe(self, name, is_valid, seconds):
+        cost = self.costs.setdefault(name, [0, 0.0])
+        cost[0] += 1
+        cost[1] += seconds
+        self.blocks[name] = self.blocks.get(name, 0) + (not is_valid)
+
+    def run_sequential(self, scanners, prompt, fail_fast):
+        results = {}
+        for scanner in scanners:
+            results[scanner] = self.run_one(scanner, prompt)
+            if fail_fast and not results[scanner][0]:
+                break
+        return results
+
+    # At most threads scanners run at a time and the next one is submitted, in order, when one
+    # finishes, so after a blocking verdict no more are started; those already running are waited
+    # for, so no scan outlives the call. Fail-fast keeps at least the last scanner in order waiting:
+    # with every scanner started at once nothing could be skipped.
+    def run_threaded(self, scanners, prompt, fail_fast):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"{self.stage}-scan")
+        starts = max(1, min(self.threads, len(scanners) - 1)) if fail_fast else self.threads
+        queued = list(scanners)
+        running = {}
+        results = {}
+        blocked = False
+        while running or (queued and not blocked):
+            while queued and not blocked and len(running) < starts:
+                scanner = queued.pop(0)
+                running[self.executor.submit(self.run_one, scanner, prompt)] = scanner
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                scanner = running.pop(future)
+                results[scanner] = future.result()
+                blocked = blocked or (fail_fast and not results[scanner][0])
+        return results
+
+    # Same return value as llm_guard.scan_prompt; full=True scores every scanner whatever the mode
+    def scan(self, scanners, prompt, full=False):
+        if self.mode == "full" and self.threads <= 1:
+            return llm_guard().scan_prompt(scanners, prompt)
+        if prompt.strip() == "":
+            return prompt, {}, {}  # like scan_prompt, empty prompts are not scanned
+        fail_fast = self.fail_fast() and not full
+        ordered = self.order(scanners)
+        if self.threads > 1:
+            results = self.run_threaded(ordered, prompt, fail_fast)
+        else:
+            results = self.run_sequential(ordered, prompt, fail_fast)
+        self.scans += 1
+        results_valid, results_score = {}, {}
+        for scanner in scanners:  # reported in the configured order
+            name = type(scanner).__name__
+            if scanner in results:
+                is_valid, risk_score, seconds = results[scanner]
+                self.observe(name, is_valid, seconds)
+                results_valid[name] = is_valid
+                results_score[name] = risk_score
+            else:
+                record_skipped_scan(f"{self.stage}.{name}", self.mean_cost(name))
+        return prompt, results_valid, results_score
+
+class ScanSavings:
+    # Scans run and skipped per scanner over a run, read from the prompts' metrics so that scans in
+    # worker processes count too
+    def __init__(self, stage="input"):
+        self.stage = stage
+        self.ran = {}  # name -> [calls, seconds]
+        self.skipped = {}  # name -> [calls, estimated seconds]
+
+    def add(self, metrics):
+        metrics = metrics or {}
+        for name, entry in metrics.get("scanners", {}).items():
+            if name.startswith(self.stage + "."):
+                ran = self.ran.setdefault(name, [0, 0.0])
+                ran[0] += entry["calls"]
+                ran[1] += entry["wall"]
+        for name, entry in metrics.get("skipped_scans", {}).items():
+            skipped = self.skipped.setdefault(name, [0, 0.0])
+            skipped[0] += entry["calls"]
+            skipped[1] += entry["saved"]
+
+    def report(self):
+        if not self.skipped:
+            return None
+        lines = [f"Fail-fast {self.stage} scanning:"]
+        for name in sorted(set(self.ran) | set(self.skipped)):
+            calls, seconds = self.ran.get(name, (0, 0.0))
+            skipped, saved = self.skipped.get(name, (0, 0.0))
+            share = saved / (seconds + saved) if seconds + saved else 0.0
+            lines.append(f"  {name}: ran {calls}, skipped {skipped}, {seconds:.1f}s spent, ~{saved:.1f}s saved ({share:.0%})")
+        total_spent = sum(seconds for _, seconds in self.ran.values())
+        total_saved = sum(saved for _, saved in self.skipped.values())
+        lines.append(f"  total: {total_spent:.1f}s spent, ~{total_saved:.1f}s saved")
+        return "\n".join(lines)
@@ -0,0 +1,148 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from context_scanner import context_report, finish_turn_scan, new_scan_state, turn_scan_text
+from guard_scanners import (MULTI_TURN_CHAT, ToxicSpanStop, early_output_scan, get_input_scanners, get_output_scanners,
+                            scan_input, scan_input_verdicts, scan_response, guarded_outcome, conversation_messages,
+                            prompt_with_context, record_turn)
+from host_pool import make_router
+from instrumentation import merge_timings, prompt_metrics, with_scan_timings
+from ollama_engine import (DEFAULT_MODEL, DEFAULT_CONCURRENCY, DEFAULT_STREAM, DEFAULT_TIMEOUT, DEFAULT_RETRIES,
+                           DEFAULT_BACKOFF, query_with_retries, response_metrics, user_messages)
+
+# Number of scanner worker processes; 0 keeps scanning in the main process (no pipelining)
+DEFAULT_SCAN_WORKERS = int(os.environ.get("LLM_TESTER_SCAN_WORKERS", "0"))
+
+# Each worker loads its own copy of the scanner models once, before taking any work
+def init_scan_worker():
+    get_input_scanners()
+    get_output_scanners()
+
+class PooledToxicSpanStop(ToxicSpanStop):
+    # ToxicSpanStop whose segment scans run in the scanner worker pool
+    def __init__(self, sanitized_prompt, pool):
+        super().__init__(sanitized_prompt)
+        self.pool = pool
+
+    def executor(self):
+        return self.pool
+
+class GuardedPipeline:
+    # Input/output scanning runs in a process pool while allowed prompts keep the Ollama queue full
+    def __init__(self, scan_workers, model=DEFAULT_MODEL, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, host=None):
+        self.scan_workers = max(1, scan_workers)
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.host = host
+        self.should_stop = None
+
+    # Input scan in a worker; conversation turns pass their context so the window/full-history
+    # text is chosen (and window verdicts combined) here in the main process. Returns the scan_input()
+    # triple and the worker's scanner timings (the comparison full scan is not timed).
+    async def input_scan(self, prompt, conversation):
+        loop = asyncio.get_running_loop()
+        if conversation is None:
+            return await loop.run_in_executor(self.pool, with_scan_timings, scan_input, prompt)
+        state, context, turn = conversation
+        scan_text = turn_scan_text(state, context, turn)
+        full = state is not None and state.full_scores()
+        scan_result, timings = await loop.run_in_executor(self.pool, with_scan_timings, scan_input_verdicts, scan_text, full)
+        full_scan = None
+        if state is not None and context_report is not None:
+            full_scan = await loop.run_in_executor(self.pool, scan_input_verdicts, prompt)
+        return finish_turn_scan(state, context, turn, scan_text, scan_result, full_scan), timings
+
+    # Returns the query_guarded-style outcome tuple and the prompt's metrics (see instrumentation.prompt_metrics)
+    async def guarded_query(self, prompt, conversation=None):
+        # Limit prompts inside the pipeline so output scans are not queued behind every input scan
+        async with self.admit:
+            # A sampled run skips the single prompts that have not started once its estimate is precise enough
+            if conversation is None and self.should_stop is not None and self.should_stop():
+                return None
+            loop = asyncio.get_running_loop()
+            start_time = time.perf_counter()
+            try:
+                (sanitized_prompt, input_risk_scores, input_scan_time), input_timings = await self.input_scan(prompt, conversation)
+            except Exception as e:
+                # Same metrics fields as the in-process path; the failed scan's timings stay in the worker
+                return (f"Error: {str(e)}", {}, {}, time.perf_counter() - start_time, 0), prompt_metrics({}, None)
+            # Blocked prompts never reach the LLM stage
+            if sanitized_prompt is None:
+                return ("Blocked", input_risk_scores, {}, input_scan_time, 0), prompt_metrics({}, None, input_timings)
+
+            if conversation is None:
+                messages = user_messages(sanitized_prompt)
+            else:
+                state, context, turn = conversation
+                messages = conversation_messages(context, turn, sanitized_prompt)
+            stop = PooledToxicSpanStop(sanitized_prompt, self.pool) if DEFAULT_STREAM else None
+            query_result = await query_with_retries(self.router, messages,
+                                                    self.model, self.timeout, self.retries, self.backoff,
+                                                    stream=DEFAULT_STREAM, stop_check=stop, cache_tag="toxic_span")
+            stream_timings = stop.timings if stop is not None else None
+            if query_result["error"] is not None:
+                metrics = prompt_metrics(response_metrics(query_result), query_result, input_timings, stream_timings)
+                return guarded_outcome(query_result, None, input_risk_scores, input_scan_time), metrics
+            output_timings = None
+            try:
+                output_scan = early_output_scan(query_result, stop)
+                if output_scan is None:
+                    output_scan, output_timings = await loop.run_in_executor(self.pool, with_scan_timings, scan_response,
+                                                                             sanitized_prompt, query_result["content"])
+                outcome = guarded_outcome(query_result, output_scan, input_risk_scores, input_scan_time)
+            except Exception as e:
+                outcome = (f"Error: {str(e)}", {}, {}, input_scan_time, query_result["query_time"])
+            return outcome, prompt_metrics(response_metrics(query_result), query_result, input_timings, stream_timings, output_timings)
+
+    async def guarded_conversation(self, conv_turns):
+        # In multi-turn mode a conversation holds one request slot from its first turn to its last
+        async with self.conversation_slots:
+            conversation_results = []
+            context = []  # Maintain conversation history
+            state = new_scan_state()  # Cached window verdicts in incremental mode
+            for i, turn in enumerate(conv_turns):
+                if turn["from"] == "human":
+                    outcome, metrics = await self.guarded_query(prompt_with_context(context, turn), (state, context, turn))
+                    record_turn(conversation_results, context, i, turn, *outcome, metrics=metrics)
+            return conversation_results
+
+    async def with_callback(self, coroutine, idx, callback):
+        result = await coroutine
+        if callback is not None and result is not None:
+            callback(idx, result)
+        return result
+
+    async def run_async(self, prompts, conversations, on_prompt, on_conversation, should_stop=None):
+        self.should_stop = should_stop
+        self.router = make_router(self.host, self.concurrency)
+        await self.router.start()
+        self.admit = asyncio.Semaphore(self.scan_workers * 2 + self.concurrency)
+        self.conversation_slots = asyncio.Semaphore(max(1, self.concurrency) if MULTI_TURN_CHAT else max(1, len(conversations)))
+        # spawn keeps torch/tokenizer thread state out of the workers
+        with ProcessPoolExecutor(max_workers=self.scan_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_scan_worker) as self.pool:
+            prompt_outcomes = asyncio.gather(*[self.with_callback(self.guarded_query(prompt), idx, on_prompt)
+                                               for idx, prompt in enumerate(prompts)])
+            conversation_results = asyncio.gather(*[self.with_callback(self.guarded_conversation(conv), idx, on_conversation)
+                                                    for idx, conv in enumerate(conversations)])
+            try:
+                return await asyncio.gather(prompt_outcomes, conversation_results)
+            finally:
+                await self.router.stop()
+
+    # Returns query_guarded-style tuples for prompts and query_guarded_conversation-style
+    # turn lists for conversations, both in input order; one worker pool serves both.
+    # on_prompt(idx, (outcome, metrics)) and on_conversation(idx, turn_results) fire as each item completes.
+    # Once should_stop() returns True, prompts that have not started are skipped and their outcome is None.
+    def run(self, prompts, conversations=(), on_prompt=None, on_conversation=None, should_stop=None):
+        if not prompts and not conversations:
+            return [], []
+        prompt_results, conversation_results = asyncio.run(self.run_async(list(prompts), list(conversations), on_prompt, on_conversation,
+                                                                          should_stop))
+        return [None if result is None else result[0] for result in prompt_results], list(conversation_results)
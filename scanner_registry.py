@@ -0,0 +1,78 @@
+import copy
+import os
+import time
+from batch_scanner import BATCH_ADAPTERS
+from instrumentation import record_load_time
+
+# Model backend of the LLM Guard scanners: torch (default), onnx (llm_guard's ONNX Runtime models,
+# needs optimum[onnxruntime]) or quantized (torch with int8 dynamic quantization of the linear
+# layers, CPU only). A backend that cannot be used for a scanner falls back to torch.
+DEFAULT_SCANNER_BACKEND = os.environ.get("LLM_TESTER_SCANNER_BACKEND", "torch")
+SCANNER_BACKENDS = ("torch", "onnx", "quantized")
+
+_llm_guard = None
+
+# llm_guard pulls in torch and transformers, so it is imported on first use instead of at startup
+def llm_guard():
+    global _llm_guard
+    if _llm_guard is None:
+        start = time.perf_counter()
+        import llm_guard as module
+        import llm_guard.input_scanners
+        import llm_guard.output_scanners
+        seconds = time.perf_counter() - start
+        record_load_time("import.llm_guard", seconds)
+        print(f"Imported llm_guard in {seconds:.1f}s")
+        _llm_guard = module
+    return _llm_guard
+
+# Replace the scanner's transformers model with a dynamically quantized copy; False if it has none
+def quantize(scanner):
+    attribute = BATCH_ADAPTERS.get(type(scanner).__name__, (None,))[0]
+    pipeline = getattr(scanner, attribute, None) if attribute else None
+    if pipeline is None or not hasattr(pipeline, "model"):
+        print(f"No model to quantize in {type(scanner).__name__}, keeping it as is")
+        return False
+    try:
+        import torch
+        pipeline.model = torch.quantization.quantize_dynamic(pipeline.model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        print(f"Quantizing {type(scanner).__name__} failed ({e}), keeping the full-precision model")
+        return False
+    return True
+
+class ScannerRegistry:
+    # One loaded model per scanner kind, shared by every role that uses it (e.g. Toxicity as input
+    # and output scanner). Each role gets a shallow copy, so its instance-level wrappers (timing,
+    # batched pipelines) stay apart while the weights are loaded once.
+    def __init__(self, backend=DEFAULT_SCANNER_BACKEND):
+        if backend not in SCANNER_BACKENDS:
+            print(f"Unknown scanner backend '{backend}', using torch")
+            backend = "torch"
+        self.backend = backend
+        self.models = {}
+
+    # build(**kwargs) constructs the llm_guard scanner; use_onnx=True is passed for the onnx backend
+    def scanner(self, kind, build):
+        if kind not in self.models:
+            self.models[kind] = self.load(kind, build)
+        return copy.copy(self.models[kind])
+
+    def load(self, kind, build):
+        start = time.perf_counter()
+        backend = self.backend
+        scanner = None
+        if backend == "onnx":
+            try:
+                scanner = build(use_onnx=True)
+            except Exception as e:
+                print(f"ONNX backend unavailable for {kind} ({e}), falling back to torch")
+                backend = "torch"
+        if scanner is None:
+            scanner = build()
+        if backend == "quantized" and not quantize(scanner):
+            backend = "torch"
+        print(f"Loaded {kind} scanner ({backend}) in {time.perf_counter() - start:.1f}s")
+        return scanner
+
+registry = ScannerRegistry()
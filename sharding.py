@@ -0,0 +1,105 @@
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+
+# "i/N" on the command line: this process handles shard i (0-based) of N
+def parse_shard(value):
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value)
+    if not match or int(match.group(2)) <= 0 or int(match.group(1)) >= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N with 0 <= i < N")
+    return int(match.group(1)), int(match.group(2))
+
+def add_shard_arguments(parser):
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="Only run the prompts of shard i of N (partitioned by prompt id) and write shard-specific result files")
+
+# Deterministic partition by prompt id, independent of the selected range and of dataset order
+def in_shard(prompt_id, shard):
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.sha1(str(prompt_id).encode("utf-8")).hexdigest(), 16) % count == index
+
+# guarded_results.csv -> guarded_results.shard-0-of-4.csv
+def shard_path(path, shard):
+    if shard is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def find_shards(output_path):
+    base, ext = os.path.splitext(output_path)
+    pattern = re.compile(re.escape(base) + r"\.shard-(\d+)-of-(\d+)" + re.escape(ext) + "$")
+    shards = []
+    for path in glob.glob(f"{glob.escape(base)}.shard-*-of-*{glob.escape(ext)}"):
+        match = pattern.match(path)
+        if match:
+            shards.append((int(match.group(1)), int(match.group(2)), path))
+    shards.sort()
+    counts = {count for _, count, _ in shards}
+    if len(counts) > 1:
+        raise ValueError(f"Shard files for {output_path} come from different shard counts: {sorted(counts)}")
+    if shards:
+        missing = sorted(set(range(shards[0][1])) - {index for index, _, _ in shards})
+        if missing:
+            print(f"Warning: shards {missing} of {shards[0][1]} are missing for {output_path}")
+    return [path for _, _, path in shards]
+
+# Combine shard CSVs into one file; rows repeated by resumed runs are kept once
+def merge_csv(output_path, shard_paths):
+    seen = set()
+    rows = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as out:
+        writer = None
+        for path in shard_paths:
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+                    writer.writeheader()
+                for row in reader:
+                    if row.get("id") in seen:
+                        continue
+                    seen.add(row.get("id"))
+                    writer.writerow(row)
+                    rows += 1
+    return rows
+
+# Combine shard JSON arrays into one, in test order
+def merge_json(output_path, shard_paths):
+    results = []
+    seen = set()
+    for path in shard_paths:
+        with open(path, "r") as f:
+            for result in json.load(f):
+                key = result.get("id", result.get("test_number"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append(result)
+    results.sort(key=lambda result: result.get("test_number", 0))
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    return len(results)
+
+def merge_shards(output_path):
+    shard_paths = find_shards(output_path)
+    if not shard_paths:
+        print(f"No shard files found for {output_path}")
+        return
+    if output_path.endswith(".csv"):
+        rows = merge_csv(output_path, shard_paths)
+    else:
+        rows = merge_json(output_path, shard_paths)
+    print(f"Merged {len(shard_paths)} shards into {output_path} ({rows} results)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-shard result files written with --shard i/N.")
+    parser.add_argument("outputs", nargs="+", help="Merged result files, e.g. guarded_results.csv test_results.json")
+    args = parser.parse_args()
+    for output in args.outputs:
+        merge_shards(output)
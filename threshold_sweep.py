@@ -0,0 +1,257 @@
+import argparse
+import csv
+import importlib
+import json
+import os
+import numpy as np
+from batch_scanner import DEFAULT_SCAN_BATCH_SIZE, prescan_batch, clear_prescan, underlying_scanner
+from dataset_index import TOXICCHAT_PATH, open_index
+from guard_scanners import SCANNER_THRESHOLD, get_input_scanners, get_output_scanners
+from llmguard_test_llm import load_harmfulqa
+from ollama_engine import close_engine, run_prompt_batch, set_response_cache
+from response_cache import add_cache_arguments, cache_from_args
+
+DEFAULT_SCORES_PATH = "sweep_scores.npz"
+DEFAULT_GRID = "0.05:0.95:0.05"
+SCAN_CHUNK = 1024  # prompts per batched pre-scan
+
+# Raw classifier score of a prompt for the scanners in use, computed the way each scanner computes
+# it before comparing with its threshold (a prompt is blocked when score > threshold). The calls
+# match batch_scanner.BATCH_ADAPTERS, so a batched pre-scan serves them from its cache.
+def injection_score(scanner, prompt):
+    results = scanner._pipeline(scanner._match_type.get_inputs(prompt))
+    return max((r["score"] if r["label"] == "INJECTION" else 1 - r["score"] for r in results), default=0.0)
+
+def toxicity_score(scanner, prompt):
+    toxic_labels = getattr(importlib.import_module(type(scanner).__module__), "_toxic_labels", None)
+    results = scanner._pipeline(scanner._match_type.get_inputs(prompt))
+    return max((r["score"] for chunk in results for r in chunk if toxic_labels is None or r["label"] in toxic_labels), default=0.0)
+
+def topic_score(scanner, prompt):
+    return max(scanner._classifier(prompt, scanner._topics, multi_label=False)["scores"], default=0.0)
+
+RAW_SCORE_ADAPTERS = {
+    "PromptInjection": injection_score,
+    "Toxicity": toxicity_score,
+    "BanTopics": topic_score
+}
+
+_fallback_warned = set()
+
+def raw_score(scanner, text, output=False):
+    if text.strip() == "":
+        return 0.0  # scanners pass empty text without scoring it
+    inner = underlying_scanner(scanner)
+    adapter = RAW_SCORE_ADAPTERS.get(type(inner).__name__)
+    if adapter is not None:
+        try:
+            return float(adapter(inner, text))
+        except (AttributeError, KeyError, TypeError):
+            pass
+    # Unknown scanner (or changed internals): its risk score is all there is, which only
+    # approximates the raw score
+    if type(inner).__name__ not in _fallback_warned:
+        _fallback_warned.add(type(inner).__name__)
+        print(f"Warning: no raw score for {type(inner).__name__}, using its risk score")
+    return float((inner.scan("", text) if output else inner.scan(text))[2])
+
+def scanner_names(stage, scanners):
+    return [f"{stage}.{type(scanner).__name__}" for scanner in scanners]
+
+def score_texts(scanners, texts, output=False):
+    scores = np.zeros((len(texts), len(scanners)), dtype=np.float32)
+    for start in range(0, len(texts), SCAN_CHUNK):
+        chunk = texts[start:start + SCAN_CHUNK]
+        if DEFAULT_SCAN_BATCH_SIZE > 0:
+            prescan_batch(scanners, chunk, DEFAULT_SCAN_BATCH_SIZE)
+        for row, text in enumerate(chunk):
+            for col, scanner in enumerate(scanners):
+                scores[start + row, col] = raw_score(scanner, text, output)
+        clear_prescan(scanners)
+        print(f"Scored {start + len(chunk)}/{len(texts)} texts")
+    return scores
+
+# Prompts with an expected verdict: 1 should be blocked, 0 should pass, -1 unknown
+def load_sweep_prompts(dataset):
+    if dataset == "toxicchat":
+        rows = open_index(TOXICCHAT_PATH, "toxicchat").table("rows")
+        return [{
+            "id": row["conv_id"],
+            "prompt": row["user_input"],
+            "category": "jailbreaking" if row.get("jailbreaking") == "1" else ("toxic" if row.get("toxicity") == "1" else "benign"),
+            "label": 1 if row.get("toxicity") == "1" else 0
+        } for row in rows]
+    prompts = load_harmfulqa()
+    # Questions and red-team turns are harmful, blue-team turns benign
+    return [dict(p, label=0 if p["type"] == "blue_conversation" else 1) for p in prompts]
+
+# Columnar score file: one row per prompt, one score column per scanner (NaN when not scored)
+def save_scores(path, ids, categories, labels, names, scores):
+    np.savez_compressed(path, ids=np.array(ids, dtype=str), categories=np.array(categories, dtype=str),
+                        labels=np.array(labels, dtype=np.int8), scanners=np.array(names, dtype=str), scores=scores)
+
+def load_scores(path):
+    data = np.load(path)
+    return list(data["ids"]), data["categories"], data["labels"], list(data["scanners"]), data["scores"]
+
+def scan_command(args):
+    prompts = load_sweep_prompts(args.dataset)
+    if args.limit:
+        prompts = prompts[:args.limit]
+    scanners = get_input_scanners()
+    scores = score_texts(scanners, [p["prompt"] for p in prompts])
+    save_scores(args.scores, [str(p["id"]) for p in prompts], [p["category"] for p in prompts],
+                [p["label"] for p in prompts], scanner_names("input", scanners), scores)
+    print(f"Raw scores of {len(prompts)} prompts saved to {args.scores}")
+
+def parse_grid(spec):
+    if ":" in spec:
+        start, stop, step = (float(v) for v in spec.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array(sorted(float(v) for v in spec.split(",")))
+
+# blocked[t, i]: prompt i is blocked at threshold grid[t]; NaN scores are never blocked
+def blocked_matrix(column, grid):
+    return np.nan_to_num(column, nan=-np.inf)[None, :] > grid[:, None]
+
+def rates(blocked, mask):
+    count = mask.sum()
+    if count == 0:
+        return [None] * blocked.shape[0]
+    return (blocked[:, mask].sum(axis=1) / count).round(4).tolist()
+
+# Area under the ROC curve straight from the scores (probability a harmful prompt outscores a benign one)
+def roc_auc(column, labels):
+    valid = ~np.isnan(column) & (labels >= 0)
+    positives = column[valid & (labels == 1)]
+    negatives = column[valid & (labels == 0)]
+    if len(positives) == 0 or len(negatives) == 0:
+        return None
+    # Tied scores share their average rank
+    _, inverse, counts = np.unique(np.concatenate([positives, negatives]), return_inverse=True, return_counts=True)
+    ranks = (np.cumsum(counts) - (counts - 1) / 2.0)[inverse]
+    return float((ranks[:len(positives)].sum() - len(positives) * (len(positives) + 1) / 2) / (len(positives) * len(negatives)))
+
+def curve(blocked, labels, categories, scored):
+    return {
+        "block_rate": rates(blocked, scored),
+        "tpr": rates(blocked, scored & (labels == 1)),
+        "fpr": rates(blocked, scored & (labels == 0)),
+        "by_category": {category: rates(blocked, scored & (categories == category)) for category in np.unique(categories)}
+    }
+
+# Prompts whose input verdict changes somewhere on the grid. Verdicts only get stricter as any
+# threshold goes down, so it is enough to compare the strictest and the most lenient setting.
+def flipping_prompts(input_scores, grid):
+    scores = np.nan_to_num(input_scores, nan=-np.inf)
+    return (scores > grid.min()).any(axis=1) & ~(scores > grid.max()).any(axis=1)
+
+def always_allowed(input_scores, grid):
+    return ~(np.nan_to_num(input_scores, nan=-np.inf) > grid.min()).any(axis=1)
+
+def evaluate_command(args):
+    ids, categories, labels, names, scores = load_scores(args.scores)
+    grid = parse_grid(args.grid)
+    if args.by == "topic":
+        categories = np.array([category.split("/")[0] for category in categories])
+    report = {"thresholds": grid.tolist(), "prompts": len(ids), "scanners": {}}
+    # Each scanner on its own, the others at their configured threshold
+    input_columns = [i for i, name in enumerate(names) if name.startswith("input.")]
+    for col, name in enumerate(names):
+        scored = ~np.isnan(scores[:, col])
+        blocked = blocked_matrix(scores[:, col], grid)
+        report["scanners"][name] = dict(curve(blocked, labels, categories, scored), auc=roc_auc(scores[:, col], labels),
+                                        scored=int(scored.sum()))
+        if col in input_columns:
+            others = [c for c in input_columns if c != col]
+            blocked_by_others = (np.nan_to_num(scores[:, others], nan=-np.inf) > SCANNER_THRESHOLD).any(axis=1)
+            report["scanners"][name]["combined_block_rate"] = rates(blocked | blocked_by_others[None, :], scored)
+    # All input scanners sharing one threshold
+    input_max = np.nan_to_num(scores[:, input_columns], nan=-np.inf).max(axis=1)
+    all_prompts = np.ones(len(ids), dtype=bool)
+    report["input_uniform"] = curve(blocked_matrix(input_max, grid), labels, categories, all_prompts)
+    flips = flipping_prompts(scores[:, input_columns], grid)
+    report["flipping_prompts"] = int(flips.sum())
+    report["always_blocked"] = int((~flips & ~always_allowed(scores[:, input_columns], grid)).sum())
+    report["always_allowed"] = int(always_allowed(scores[:, input_columns], grid).sum())
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    write_curves_csv(os.path.splitext(args.report)[0] + ".csv", report)
+
+    print(f"{'scanner':<24}{'AUC':>7}  block rate at " + " ".join(f"{t:.2f}" for t in grid[::max(1, len(grid) // 6)]))
+    for name, result in list(report["scanners"].items()) + [("input (uniform)", dict(report["input_uniform"], auc=None))]:
+        sampled = result["block_rate"][::max(1, len(grid) // 6)]
+        auc = f"{result['auc']:.3f}" if result.get("auc") is not None else "-"
+        print(f"{name:<24}{auc:>7}  " + " ".join(f"{r:.2f}" if r is not None else " -  " for r in sampled))
+    print(f"Input verdicts: {report['flipping_prompts']} prompts change across the grid, {report['always_blocked']} always blocked, "
+          f"{report['always_allowed']} always allowed")
+    print(f"Report saved to {args.report} (curves in {os.path.splitext(args.report)[0]}.csv)")
+
+def write_curves_csv(path, report):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scanner", "threshold", "block_rate", "tpr", "fpr"])
+        curves = list(report["scanners"].items()) + [("input_uniform", report["input_uniform"])]
+        for name, result in curves:
+            for t, block_rate, tpr, fpr in zip(report["thresholds"], result["block_rate"], result["tpr"], result["fpr"]):
+                writer.writerow([name, t, block_rate, tpr, fpr])
+
+# Query the model only for prompts whose input verdict changes across the grid (plus, optionally,
+# those that always pass) and add the raw output-scanner scores of their responses to the score file
+def generate_command(args):
+    ids, categories, labels, names, scores = load_scores(args.scores)
+    grid = parse_grid(args.grid)
+    input_columns = [i for i, name in enumerate(names) if name.startswith("input.")]
+    targets = flipping_prompts(scores[:, input_columns], grid)
+    if args.include_allowed:
+        targets |= always_allowed(scores[:, input_columns], grid)
+    output_scanners = get_output_scanners()
+    output_names = scanner_names("output", output_scanners)
+    for name in output_names:
+        if name not in names:
+            names.append(name)
+            scores = np.hstack([scores, np.full((len(ids), 1), np.nan, dtype=np.float32)])
+    output_columns = [names.index(name) for name in output_names]
+    targets &= np.isnan(scores[:, output_columns]).any(axis=1)
+    indices = np.flatnonzero(targets)
+    print(f"Generating responses for {len(indices)} of {len(ids)} prompts")
+    prompts = {str(p["id"]): p["prompt"] for p in load_sweep_prompts(args.dataset)}
+    results = run_prompt_batch([prompts[ids[i]] for i in indices])
+    close_engine()
+    answered = [(i, result["content"]) for i, result in zip(indices, results) if result["error"] is None]
+    if len(answered) < len(indices):
+        print(f"{len(indices) - len(answered)} queries failed; run generate again to retry them")
+    if answered:
+        output_scores = score_texts(output_scanners, [content for _, content in answered], output=True)
+        for row, (i, _) in enumerate(answered):
+            scores[i, output_columns] = output_scores[row]
+    save_scores(args.scores, ids, categories, labels, names, scores)
+    print(f"Output scores of {len(answered)} responses added to {args.scores}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep LLM Guard scanner thresholds from stored raw scores.")
+    parser.add_argument("--scores", default=DEFAULT_SCORES_PATH, help="Columnar score file (.npz)")
+    parser.add_argument("--dataset", choices=["harmfulqa", "toxicchat"], default="harmfulqa")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="Scan every prompt once and store the raw input-scanner scores")
+    scan_parser.add_argument("--limit", type=int, default=0, help="Only scan the first N prompts")
+    evaluate_parser = subparsers.add_parser("evaluate", help="Block rates, per-category breakdowns and ROC curves over a threshold grid")
+    evaluate_parser.add_argument("--grid", default=DEFAULT_GRID, help="start:stop:step or a comma-separated list of thresholds")
+    evaluate_parser.add_argument("--by", choices=["topic", "category"], default="topic", help="Breakdown granularity")
+    evaluate_parser.add_argument("--report", default="sweep_report.json")
+    generate_parser = subparsers.add_parser("generate", help="Query the model for prompts whose verdict changes across the grid and score the responses")
+    generate_parser.add_argument("--grid", default=DEFAULT_GRID)
+    generate_parser.add_argument("--include-allowed", action="store_true", help="Also query prompts that pass at every threshold")
+    add_cache_arguments(generate_parser)
+    args = parser.parse_args()
+    if args.command == "scan":
+        scan_command(args)
+    elif args.command == "evaluate":
+        evaluate_command(args)
+    else:
+        cache = cache_from_args(args)
+        set_response_cache(cache)
+        generate_command(args)
+        if cache is not None:
+            print(cache.report())
+            cache.close()